@@ -0,0 +1,100 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+# ========== IVF CONFIGURATION ==========
+# Galleries smaller than this are scanned exactly - brute force is already sub-millisecond there
+ANN_MIN_GALLERY_SIZE = int(os.getenv("FACE_ANN_MIN_SIZE", "5000"))
+# Number of k-means cells (0 = about 4 * sqrt(N))
+ANN_LISTS = int(os.getenv("FACE_ANN_LISTS", "0"))
+# Cells scanned per query - the main recall/latency knob
+ANN_PROBES = int(os.getenv("FACE_ANN_PROBES", "8"))
+# Candidates returned from the probed cells, ranked by exact distance
+ANN_RERANK_K = int(os.getenv("FACE_ANN_RERANK_K", "10"))
+# Re-scan the whole gallery when the probed cells hold no match under threshold
+ANN_EXACT_FALLBACK = os.getenv("FACE_ANN_EXACT_FALLBACK", "true").lower() in ("true", "1", "yes")
+ANN_TRAIN_ITERATIONS = int(os.getenv("FACE_ANN_TRAIN_ITERATIONS", "10"))
+ANN_TRAIN_SAMPLE = int(os.getenv("FACE_ANN_TRAIN_SAMPLE", "20000"))
+
+
+class IVFIndex:
+    """Inverted-file coarse quantizer over a gallery matrix.
+
+    The index only owns the k-means centroids. Cell membership is a label per
+    gallery row, kept by the gallery next to its matrix, so in-place appends and
+    swap-removes stay O(1). Distances to candidates are always computed on the
+    full float32 vectors, so a hit means exactly what a brute-force hit means.
+    """
+
+    def __init__(self, n_lists: int = ANN_LISTS, n_probe: int = ANN_PROBES,
+                 n_iter: int = ANN_TRAIN_ITERATIONS, sample_size: int = ANN_TRAIN_SAMPLE, seed: int = 0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.sample_size = sample_size
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_size = 0
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def train(self, matrix: np.ndarray):
+        """Fit centroids with Lloyd's k-means on (a sample of) the gallery"""
+        n = len(matrix)
+        if n == 0:
+            raise ValueError("Cannot train an IVF index on an empty gallery")
+
+        rng = np.random.default_rng(self.seed)
+        n_lists = self.n_lists or int(4 * np.sqrt(n))
+        n_lists = max(1, min(n_lists, n))
+
+        sample = matrix
+        if n > self.sample_size:
+            sample = matrix[rng.choice(n, self.sample_size, replace=False)]
+        n_lists = min(n_lists, len(sample))
+
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+
+        for _ in range(self.n_iter):
+            labels = self._nearest(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=n_lists)
+
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, np.newaxis]
+            # Re-seed empty cells from random points so no list stays dead
+            if not filled.all():
+                centroids[~filled] = sample[rng.choice(len(sample), int((~filled).sum()), replace=False)]
+
+        self.centroids = centroids.astype(np.float32, copy=False)
+        self.trained_size = n
+
+    @staticmethod
+    def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2, and ||x||^2 doesn't change the argmin
+        scores = vectors @ centroids.T
+        scores *= -2
+        scores += (centroids * centroids).sum(axis=1)
+        return scores.argmin(axis=1)
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        """Cell label for each row"""
+        vectors = np.atleast_2d(vectors)
+        if len(vectors) == 0:
+            return np.empty(0, dtype=np.int32)
+        return self._nearest(vectors, self.centroids).astype(np.int32)
+
+    def candidates(self, query: np.ndarray, labels: np.ndarray) -> np.ndarray:
+        """Row numbers that live in the n_probe cells closest to the query"""
+        n_probe = min(self.n_probe, len(self.centroids))
+        cell_distances = ((self.centroids - query) ** 2).sum(axis=1)
+        probes = np.argpartition(cell_distances, n_probe - 1)[:n_probe]
+        return np.flatnonzero(np.isin(labels, probes))
+
+    def needs_retrain(self, size: int) -> bool:
+        """Centroids fitted on a much smaller gallery give lopsided cells"""
+        return not self.is_trained or size > 2 * self.trained_size
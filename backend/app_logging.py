@@ -0,0 +1,206 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from metrics import gauge, log_records, log_records_dropped, log_emit_seconds
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Per-module overrides, e.g. "ml_resilience=DEBUG,job_queue=WARNING" (httpx logs every ML request at INFO)
+LOG_LEVELS = os.getenv("LOG_LEVELS", "httpx=WARNING")
+# "json" (one object per line) or "text" for reading logs in a terminal
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Share of requests whose DEBUG lines are kept (all or nothing per request, so kept traces are complete)
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+# Records waiting for the writer thread; beyond this new records are dropped instead of blocking
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+REQUEST_ID_HEADER = "X-Request-ID"
+MAX_REQUEST_ID_LENGTH = 128
+
+# LogRecord attributes that are not user-supplied `extra` fields
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+
+class LogContext:
+    """Per-request (or per-job) logging state, carried in a ContextVar into tasks and worker threads"""
+
+    __slots__ = ("request_id", "keep_debug", "records")
+
+    def __init__(self, request_id: str, keep_debug: bool):
+        self.request_id = request_id
+        self.keep_debug = keep_debug
+        self.records = 0
+
+
+_log_context: ContextVar[Optional[LogContext]] = ContextVar("log_context", default=None)
+
+
+def current_request_id() -> Optional[str]:
+    context = _log_context.get()
+    return context.request_id if context else None
+
+
+def new_request_id(incoming: Optional[str] = None) -> str:
+    """Reuse a caller's X-Request-ID when it is sane, otherwise make one up"""
+    if incoming and len(incoming) <= MAX_REQUEST_ID_LENGTH and incoming.isprintable():
+        return incoming
+    return uuid.uuid4().hex
+
+
+@contextmanager
+def log_context(request_id: str, keep_debug: Optional[bool] = None):
+    """Tag every record logged inside the block with request_id; DEBUG lines are kept for a
+    LOG_DEBUG_SAMPLE_RATE share of contexts unless keep_debug says otherwise"""
+    if keep_debug is None:
+        keep_debug = random.random() < LOG_DEBUG_SAMPLE_RATE
+    context = LogContext(request_id, keep_debug)
+    token = _log_context.set(context)
+    try:
+        yield context
+    finally:
+        _log_context.reset(token)
+
+
+class RequestContextFilter(logging.Filter):
+    """Runs on the caller's thread: stamps the request id and applies DEBUG sampling"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _log_context.get()
+        if context is None:
+            record.request_id = None
+            return True
+        if record.levelno <= logging.DEBUG and not context.keep_debug:
+            log_records_dropped.inc(reason="sampled")
+            return False
+        record.request_id = context.request_id
+        context.records += 1
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the writer thread; never blocks the event loop on I/O or a full queue"""
+
+    def emit(self, record: logging.LogRecord):
+        start = time.perf_counter()
+        try:
+            self.enqueue(self.prepare(record))
+        except queue.Full:
+            log_records_dropped.inc(reason="queue_full")
+            return
+        except Exception:
+            self.handleError(record)
+            return
+        log_records.inc(level=record.levelname)
+        log_emit_seconds.inc(time.perf_counter() - start)
+
+    def enqueue(self, record: logging.LogRecord):
+        self.queue.put_nowait(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only resolve what cannot cross threads (args, tracebacks); JSON encoding happens on the writer thread
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        return record
+
+
+class DrainingQueueListener(QueueListener):
+    def enqueue_sentinel(self):
+        # Shutdown may find the queue full; wait for the writer to make room instead of failing
+        self.queue.put(self._sentinel, timeout=5)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        if getattr(record, "request_id", None) is None:
+            record.request_id = "-"
+        return super().format(record)
+
+
+def parse_levels(spec: str) -> dict:
+    """"main=INFO,ml_resilience=DEBUG" -> {"main": "INFO", "ml_resilience": "DEBUG"}"""
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+_listener: Optional[DrainingQueueListener] = None
+_queue: Optional[queue.Queue] = None
+
+
+def configure_logging():
+    """Route the root logger through a bounded queue to a stdout writer thread (idempotent)"""
+    global _listener, _queue
+    if _listener is not None:
+        return
+
+    _queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    writer = logging.StreamHandler(sys.stdout)
+    writer.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+
+    handler = NonBlockingQueueHandler(_queue)
+    handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+    for name, level in parse_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = DrainingQueueListener(_queue, writer, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+gauge("log_queue_depth", "Log records waiting for the writer thread", lambda: {(): _queue.qsize() if _queue else 0})
+
+
+def stop_logging():
+    """Flush what is queued and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,301 @@
+import csv
+import io
+import logging
+import os
+import tempfile
+from datetime import date, timedelta
+from typing import Iterator
+
+import xlsxwriter
+from sqlalchemy import and_, case, func, distinct
+
+from database import Attendance, Student, SessionLocal
+from calendar_cache import calendar_cache
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per round-trip from the server-side cursor
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+# Exports stay in memory up to this size, then spill to a temp file on disk
+EXPORT_SPOOL_MAX_BYTES = int(os.getenv("EXPORT_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+LOG_COLUMNS = [
+    ('Date', 12), ('Day', 12), ('Student Name', 20), ('Roll Number', 15), ('Department', 15),
+    ('Time', 12), ('Status', 25), ('Face Match', 12), ('Dress Code', 15)
+]
+SUMMARY_COLUMNS = [
+    'Roll Number', 'Student Name', 'Department', 'Total Present', 'Compliant', 'Violations', 'Attendance %'
+]
+# Machine-readable column names shared by the CSV and Parquet exports
+BULK_COLUMNS = [
+    'date', 'time', 'student_id', 'student_name', 'roll_number', 'department',
+    'status', 'face_match', 'dress_code_match'
+]
+
+
+def attendance_rows(db, institute_id: int, date_from: date, date_to: date):
+    """Attendance joined with its student in ONE query, streamed from a server-side cursor"""
+    return db.query(
+        Attendance.student_id,
+        Attendance.date,
+        Attendance.time,
+        Attendance.status,
+        Attendance.face_match,
+        Attendance.dress_code_match,
+        Student.name,
+        Student.roll_number,
+        Student.department
+    ).join(Student, Attendance.student_id == Student.id).filter(
+        Student.institute_id == institute_id,
+        Attendance.date >= date_from,
+        Attendance.date <= date_to
+    ).order_by(Attendance.date.desc(), Attendance.time.desc()).yield_per(EXPORT_BATCH_SIZE)
+
+
+def attended_days(db, institute_id: int, date_from: date, date_to: date) -> int:
+    """Days in the range on which anyone from the institute was marked (the original % denominator)"""
+    return db.query(func.count(distinct(Attendance.date))).join(
+        Student, Attendance.student_id == Student.id
+    ).filter(
+        Student.institute_id == institute_id,
+        Attendance.date >= date_from,
+        Attendance.date <= date_to
+    ).scalar() or 0
+
+
+def working_days(db, institute_id: int, date_from: date, date_to: date) -> int:
+    """Working days in the range per the institute calendar (weekends + Holiday overrides), up to today"""
+    date_to = min(date_to, date.today())
+    count = 0
+    day = date_from
+    while day <= date_to:
+        month_calendar = calendar_cache.get(db, institute_id, day)
+        if not month_calendar.is_holiday(day):
+            count += 1
+        day += timedelta(days=1)
+    return count
+
+
+def student_summary_rows(db, institute_id: int, date_from: date, date_to: date, denominator: int):
+    """Per-student totals, compliance, violations and attendance % in one GROUP BY.
+
+    The date filter sits in the LEFT JOIN condition so students with no
+    attendance in the range still get a row of zeros.
+    """
+    total_present = func.count(Attendance.id)
+    compliant = func.coalesce(func.sum(case((Attendance.dress_code_match == True, 1), else_=0)), 0)
+    # As in the original report: every mark not confirmed compliant counts as a violation
+    violations = total_present - compliant
+    if denominator > 0:
+        attendance_percentage = total_present * 100.0 / denominator
+    else:
+        attendance_percentage = total_present * 0.0
+
+    return db.query(
+        Student.roll_number,
+        Student.name,
+        Student.department,
+        total_present.label('total_present'),
+        compliant.label('compliant'),
+        violations.label('violations'),
+        attendance_percentage.label('attendance_percentage')
+    ).outerjoin(Attendance, and_(
+        Attendance.student_id == Student.id,
+        Attendance.date >= date_from,
+        Attendance.date <= date_to
+    )).filter(
+        Student.institute_id == institute_id
+    ).group_by(
+        Student.id, Student.roll_number, Student.name, Student.department
+    ).order_by(Student.id).yield_per(EXPORT_BATCH_SIZE)
+
+
+def dress_code_label(dress_code_match) -> str:
+    """NULL means the dress code was not checked (group photo check-ins)"""
+    if dress_code_match is None:
+        return 'Not Checked'
+    return 'Compliant' if dress_code_match else 'Violation'
+
+
+def _write_attendance_log(worksheet, header_format, rows) -> int:
+    for col_num, (title, width) in enumerate(LOG_COLUMNS):
+        worksheet.set_column(col_num, col_num, width)
+        worksheet.write(0, col_num, title, header_format)
+
+    row_num = 0
+    for row in rows:
+        row_num += 1
+        worksheet.write_row(row_num, 0, [
+            row.date.strftime('%Y-%m-%d'),
+            row.date.strftime('%A'),
+            row.name,
+            row.roll_number,
+            row.department,
+            row.time.strftime('%H:%M:%S'),
+            row.status,
+            'Yes' if row.face_match else 'No',
+            dress_code_label(row.dress_code_match)
+        ])
+
+    return row_num
+
+
+def _write_student_summary(worksheet, header_format, rows):
+    worksheet.set_column(0, len(SUMMARY_COLUMNS) - 1, 15)
+    for col_num, title in enumerate(SUMMARY_COLUMNS):
+        worksheet.write(0, col_num, title, header_format)
+
+    for row_num, row in enumerate(rows, start=1):
+        worksheet.write_row(row_num, 0, [
+            row.roll_number,
+            row.name,
+            row.department,
+            row.total_present,
+            int(row.compliant),
+            int(row.violations),
+            f"{float(row.attendance_percentage):.1f}%"
+        ])
+
+
+def write_attendance_xlsx(db, institute_id: int, date_from: date, date_to: date, holiday_aware: bool = False):
+    """Build the report with xlsxwriter's constant_memory mode into a spooled temp file.
+
+    Rows go straight from the cursor to the worksheet, so memory stays flat no
+    matter how many records the range covers. The returned file is rewound.
+    With holiday_aware, attendance % is measured against the institute's working
+    days instead of the days on which attendance was taken.
+    """
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES)
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+
+    try:
+        header_format = workbook.add_format({
+            'bold': True,
+            'bg_color': '#3a4a44',
+            'font_color': 'white',
+            'border': 1,
+            'align': 'center'
+        })
+
+        log_sheet = workbook.add_worksheet('Attendance Log')
+        summary_sheet = workbook.add_worksheet('Student Summary')
+
+        log_rows = _write_attendance_log(
+            log_sheet, header_format, attendance_rows(db, institute_id, date_from, date_to)
+        )
+
+        if holiday_aware:
+            denominator = working_days(db, institute_id, date_from, date_to)
+        else:
+            denominator = attended_days(db, institute_id, date_from, date_to)
+        _write_student_summary(
+            summary_sheet, header_format,
+            student_summary_rows(db, institute_id, date_from, date_to, denominator)
+        )
+
+        workbook.close()
+    except Exception:
+        output.close()
+        raise
+
+    logger.debug("Excel export: %s attendance rows (%s to %s), %% over %s days", log_rows, date_from, date_to, denominator)
+    output.seek(0)
+    return output
+
+
+def _bulk_values(row) -> list:
+    return [
+        row.date, row.time, row.student_id, row.name, row.roll_number, row.department,
+        row.status, bool(row.face_match), row.dress_code_match
+    ]
+
+
+def iter_attendance_csv(institute_id: int, date_from: date, date_to: date) -> Iterator[bytes]:
+    """Stream the joined rows as CSV while they come off the cursor.
+
+    Runs after the endpoint has returned, so it owns its own session rather than
+    the request-scoped one.
+    """
+    db = SessionLocal()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    try:
+        writer.writerow(BULK_COLUMNS)
+        for row_num, row in enumerate(attendance_rows(db, institute_id, date_from, date_to), start=1):
+            values = _bulk_values(row)
+            values[0] = row.date.isoformat()
+            values[1] = row.time.strftime('%H:%M:%S')
+            writer.writerow(values)
+
+            if row_num % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+
+        yield buffer.getvalue().encode('utf-8')
+    finally:
+        db.close()
+
+
+def write_attendance_parquet(db, institute_id: int, date_from: date, date_to: date):
+    """Write the joined rows as Parquet, one row group per EXPORT_BATCH_SIZE rows, into a spooled temp file"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('date', pa.date32()),
+        ('time', pa.time64('us')),
+        ('student_id', pa.int64()),
+        ('student_name', pa.string()),
+        ('roll_number', pa.string()),
+        ('department', pa.string()),
+        ('status', pa.string()),
+        ('face_match', pa.bool_()),
+        ('dress_code_match', pa.bool_()),
+    ])
+
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES)
+
+    def flush(writer, batch):
+        columns = list(zip(*batch))
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+            schema=schema
+        ))
+
+    try:
+        # The writer is closed (and its native resources released) even if a query or batch fails
+        with pq.ParquetWriter(output, schema, compression='snappy') as writer:
+            batch = []
+            total_rows = 0
+            for row in attendance_rows(db, institute_id, date_from, date_to):
+                batch.append(_bulk_values(row))
+                if len(batch) == EXPORT_BATCH_SIZE:
+                    flush(writer, batch)
+                    total_rows += len(batch)
+                    batch = []
+
+            if batch:
+                flush(writer, batch)
+                total_rows += len(batch)
+    except Exception:
+        output.close()
+        raise
+
+    logger.debug("Parquet export: %s attendance rows (%s to %s)", total_rows, date_from, date_to)
+    output.seek(0)
+    return output
+
+
+def iter_file_chunks(file, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Stream a file in fixed-size chunks and close it afterwards"""
+    try:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        file.close()
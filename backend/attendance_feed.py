@@ -0,0 +1,132 @@
+import asyncio
+import json
+import os
+from datetime import date
+from typing import Dict, List, Optional, Set
+
+from database import Attendance, Student
+
+# Events a client may fall behind by before it is disconnected (it resumes via Last-Event-ID)
+FEED_QUEUE_SIZE = int(os.getenv("FEED_QUEUE_SIZE", "256"))
+FEED_HEARTBEAT_SECONDS = float(os.getenv("FEED_HEARTBEAT_SECONDS", "15"))
+# Ids are assigned at INSERT but rows commit in any order, so a row with a lower id than the
+# client's Last-Event-ID may have committed after it. Replay re-sends this many ids below it.
+FEED_REPLAY_OVERLAP = int(os.getenv("FEED_REPLAY_OVERLAP", "100"))
+
+# Pushed to a subscriber's queue when it has to reconnect
+_DISCONNECT = None
+
+
+def attendance_event(attendance_id: int, student_name: str, roll_number: str, department: str,
+                     time, status: str, event: str = "attendance") -> dict:
+    """Same fields as a row of /admin/attendance/{institute_id}/today"""
+    return {
+        "event": event,
+        "id": attendance_id,
+        "student_name": student_name,
+        "roll_number": roll_number,
+        "department": department,
+        "time": time.strftime("%H:%M:%S"),
+        "status": status
+    }
+
+
+def format_sse(event: dict) -> str:
+    """New rows carry an SSE id (the attendance id) so clients can resume; updates to an
+    existing row (e.g. a settled dress code) don't, leaving the client's Last-Event-ID alone"""
+    data = {k: v for k, v in event.items() if k != "event"}
+    lines = f"id: {event['id']}\n" if event["event"] == "attendance" else ""
+    return f"{lines}event: {event['event']}\ndata: {json.dumps(data)}\n\n"
+
+
+def load_events_since(db, institute_id: int, after_id: int, overlap: int = FEED_REPLAY_OVERLAP) -> List[dict]:
+    """Today's rows from after_id - overlap on - used to replay what a reconnecting client missed.
+
+    The overlap catches rows that committed out of id order; it re-sends events the
+    client may already have, so clients key rows by event id. A row is still missed
+    if more than `overlap` newer check-ins committed before it did.
+    """
+    rows = db.query(
+        Attendance.id, Student.name, Student.roll_number, Student.department, Attendance.time, Attendance.status
+    ).join(Student, Attendance.student_id == Student.id).filter(
+        Student.institute_id == institute_id,
+        Attendance.date == date.today(),
+        Attendance.id > after_id - overlap
+    ).order_by(Attendance.id).all()
+
+    return [attendance_event(*row) for row in rows]
+
+
+class AttendanceFeed:
+    """In-process pub/sub of committed attendance rows, one channel per institute.
+
+    Only rows marked by this worker are published; with several workers each
+    one serves its own check-ins (clients still catch up through replay).
+    Must be used from the event loop thread.
+    """
+
+    def __init__(self, queue_size: int = FEED_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        # Set when something is put on a subscriber's queue; next_event waits on it, not on queue.get()
+        self._arrived: Dict[asyncio.Queue, asyncio.Event] = {}
+
+    def subscribe(self, institute_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(institute_id, set()).add(queue)
+        self._arrived[queue] = asyncio.Event()
+        return queue
+
+    def unsubscribe(self, institute_id: int, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(institute_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if queue in self._arrived:
+                # Wake a waiting next_event so it picks up the disconnect marker
+                self._arrived.pop(queue).set()
+            if not subscribers:
+                del self._subscribers[institute_id]
+
+    def subscriber_count(self, institute_id: Optional[int] = None) -> int:
+        if institute_id is not None:
+            return len(self._subscribers.get(institute_id, ()))
+        return sum(len(s) for s in self._subscribers.values())
+
+    def publish(self, institute_id: int, event: dict):
+        for queue in list(self._subscribers.get(institute_id, ())):
+            try:
+                queue.put_nowait(event)
+                self._arrived[queue].set()
+            except asyncio.QueueFull:
+                # Lagging client: drop its backlog and tell it to reconnect and replay from the DB
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(_DISCONNECT)
+                self.unsubscribe(institute_id, queue)
+
+    async def next_event(self, queue: asyncio.Queue, timeout: float = FEED_HEARTBEAT_SECONDS):
+        """Next event, "heartbeat" when idle for `timeout` seconds, or None when the client must reconnect.
+
+        Events are only taken with get_nowait(), so timing out never loses one already dequeued.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                return queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            arrived = self._arrived.get(queue)
+            if arrived is None:
+                return _DISCONNECT
+            arrived.clear()
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return "heartbeat"
+            try:
+                await asyncio.wait_for(arrived.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return "heartbeat"
+
+
+attendance_feed = AttendanceFeed()
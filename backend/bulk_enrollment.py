@@ -0,0 +1,298 @@
+import asyncio
+import csv
+import io
+import logging
+import os
+import threading
+import uuid
+import zipfile
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from database import Student, SessionLocal, run_db
+
+logger = logging.getLogger(__name__)
+
+# Photos in flight to the ML service at once for one job
+BULK_ENROLL_CONCURRENCY = int(os.getenv("BULK_ENROLL_CONCURRENCY", "8"))
+# Students per INSERT round-trip
+BULK_ENROLL_BATCH_SIZE = int(os.getenv("BULK_ENROLL_BATCH_SIZE", "500"))
+BULK_ENROLL_MAX_ROWS = int(os.getenv("BULK_ENROLL_MAX_ROWS", "10000"))
+# Largest uncompressed photo or manifest read from the ZIP (checked before decompressing)
+BULK_ENROLL_MAX_FILE_BYTES = int(os.getenv("BULK_ENROLL_MAX_FILE_BYTES", str(10 * 1024 * 1024)))
+# Finished jobs stay pollable for this long (seconds)
+BULK_JOB_TTL = float(os.getenv("BULK_JOB_TTL", "3600"))
+
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+MANIFEST_COLUMNS = ("name", "roll_number", "department")
+
+
+class ManifestRow(NamedTuple):
+    line: int
+    name: str
+    roll_number: str
+    department: str
+    photo: str  # member name inside the ZIP
+
+
+def index_photos(archive: zipfile.ZipFile) -> Dict[str, str]:
+    """Map lower-cased file name and file stem (e.g. roll number) to the ZIP member, ignoring folders"""
+    photos = {}
+    for member in archive.namelist():
+        base = os.path.basename(member)
+        if not base or base.startswith(".") or not base.lower().endswith(PHOTO_EXTENSIONS):
+            continue
+        photos.setdefault(base.lower(), member)
+        photos.setdefault(os.path.splitext(base)[0].lower(), member)
+    return photos
+
+
+def read_member(archive: zipfile.ZipFile, member: str, limit: int = BULK_ENROLL_MAX_FILE_BYTES) -> bytes:
+    """Read one ZIP member, refusing it by its declared size before anything is decompressed"""
+    size = archive.getinfo(member).file_size
+    if size > limit:
+        raise ValueError(f"{os.path.basename(member)} is {size} bytes uncompressed, the limit is {limit}")
+    return archive.read(member)
+
+
+def find_manifest(archive: zipfile.ZipFile) -> Optional[str]:
+    """CSV manifest bundled inside the ZIP, if the admin didn't upload one separately"""
+    for member in archive.namelist():
+        base = os.path.basename(member)
+        if base.lower().endswith(".csv") and not base.startswith("."):
+            return member
+    return None
+
+
+def parse_manifest(text: str, photos: Dict[str, str]) -> Tuple[List[ManifestRow], List[dict]]:
+    """Validate the manifest against the ZIP: returns (rows to enroll, rejected rows with a reason).
+
+    Photos are matched by an optional `photo` column, else by `<roll_number>.<ext>`.
+    """
+    reader = csv.DictReader(io.StringIO(text.lstrip("\ufeff")))
+    headers = {h.strip().lower() for h in (reader.fieldnames or [])}
+    missing = [c for c in MANIFEST_COLUMNS if c not in headers]
+    if missing:
+        raise ValueError(f"Manifest is missing column(s): {', '.join(missing)}")
+
+    rows, rejected, seen = [], [], set()
+    for line, raw in enumerate(reader, start=2):
+        record = {(k or "").strip().lower(): (v or "").strip() for k, v in raw.items()}
+        name, roll_number, department = (record.get(c, "") for c in MANIFEST_COLUMNS)
+
+        reason = None
+        if not (name and roll_number and department):
+            reason = "name, roll_number and department are required"
+        elif roll_number in seen:
+            reason = "duplicate roll number in manifest"
+        else:
+            key = (record.get("photo") or roll_number).lower()
+            photo = photos.get(key) or photos.get(os.path.splitext(key)[0])
+            if photo is None:
+                reason = "no photo in ZIP"
+
+        if reason:
+            rejected.append({"line": line, "roll_number": roll_number or None, "reason": reason})
+            continue
+
+        seen.add(roll_number)
+        rows.append(ManifestRow(line, name, roll_number, department, photo))
+
+    if len(rows) > BULK_ENROLL_MAX_ROWS:
+        raise ValueError(f"Manifest has {len(rows)} students, the limit per upload is {BULK_ENROLL_MAX_ROWS}")
+
+    return rows, rejected
+
+
+class EnrollmentJob:
+    """Progress of one bulk enrollment, polled through /admin/students/bulk/{job_id}"""
+
+    def __init__(self, institute_id: int, total: int, rejected: List[dict]):
+        self.id = uuid.uuid4().hex
+        self.institute_id = institute_id
+        self.total = total + len(rejected)
+        self.state = "queued"
+        self.processed = len(rejected)
+        self.enrolled = 0
+        self.skipped = list(rejected)
+        self.error: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def skip(self, row: ManifestRow, reason: str):
+        self.skipped.append({"line": row.line, "roll_number": row.roll_number, "reason": reason})
+        self.processed += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "job_id": self.id,
+            "institute_id": self.institute_id,
+            "state": self.state,
+            "total": self.total,
+            "processed": self.processed,
+            "enrolled": self.enrolled,
+            "skipped": len(self.skipped),
+            "progress": round(100 * self.processed / self.total, 1) if self.total else 100.0,
+            "errors": self.skipped,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class EnrollmentJobs:
+    """In-process job registry - poll on the same worker that accepted the upload"""
+
+    def __init__(self, ttl: float = BULK_JOB_TTL):
+        self.ttl = ttl
+        self._jobs: Dict[str, EnrollmentJob] = {}
+        self._lock = threading.Lock()
+
+    def add(self, job: EnrollmentJob):
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+
+    def get(self, job_id: str) -> Optional[EnrollmentJob]:
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        now = datetime.utcnow()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and (now - job.finished_at).total_seconds() > self.ttl:
+                del self._jobs[job_id]
+
+
+def existing_roll_numbers(db, institute_id: int, roll_numbers: List[str]) -> set:
+    """Roll numbers already registered for the institute - one query for the whole manifest"""
+    rows = db.query(Student.roll_number).filter(
+        Student.institute_id == institute_id,
+        Student.roll_number.in_(roll_numbers)
+    ).all()
+    return {row.roll_number for row in rows}
+
+
+def insert_students(db, mappings: List[dict]) -> Dict[str, int]:
+    """ONE INSERT .. ON CONFLICT DO NOTHING; returns {roll_number: student id} of the rows inserted.
+
+    Roll numbers registered since the up-front check are left out instead of failing the batch.
+    """
+    statement = pg_insert(Student).values(mappings).on_conflict_do_nothing(
+        index_elements=["institute_id", "roll_number"]
+    ).returning(Student.id, Student.roll_number)
+    inserted = {row.roll_number: row.id for row in db.execute(statement)}
+    db.commit()
+    return inserted
+
+
+async def run_enrollment(
+    job: EnrollmentJob,
+    archive_path: str,
+    rows: List[ManifestRow],
+    encode: Callable[[bytes], Awaitable[bytes]],
+    on_inserted: Callable[[int, int, bytes], None]
+):
+    """Encode every photo with BULK_ENROLL_CONCURRENCY workers and insert students in batches.
+
+    `encode` turns raw photo bytes into packed face-encoding bytes, raising with a
+    user-facing reason when the photo is unusable. `on_inserted(institute_id,
+    student_id, face_encoding)` runs in a worker thread for every inserted student.
+    The archive file is deleted at the end.
+    """
+    db = SessionLocal()
+    archive = zipfile.ZipFile(archive_path)
+    # ZipFile reads share one file handle
+    archive_lock = threading.Lock()
+    batch: List[Tuple[ManifestRow, dict]] = []
+    batch_lock = asyncio.Lock()
+
+    def read_photo(member: str) -> bytes:
+        with archive_lock:
+            return read_member(archive, member)
+
+    def add_inserted(pending: List[Tuple[ManifestRow, dict]], inserted: Dict[str, int]):
+        for row, mapping in pending:
+            if row.roll_number in inserted:
+                on_inserted(job.institute_id, inserted[row.roll_number], mapping["face_encoding"])
+
+    async def flush():
+        nonlocal batch
+        pending, batch = batch, []
+        if pending:
+            inserted = await run_db(insert_students, db, [mapping for _, mapping in pending])
+            for row, _ in pending:
+                if row.roll_number not in inserted:
+                    job.processed -= 1
+                    job.skip(row, "roll number already registered")
+            job.enrolled += len(inserted)
+            await asyncio.to_thread(add_inserted, pending, inserted)
+            logger.debug("Bulk enrollment %s: inserted %s students (%s so far)", job.id, len(inserted), job.enrolled)
+
+    async def enroll(row: ManifestRow):
+        try:
+            data = await asyncio.to_thread(read_photo, row.photo)
+            face_encoding = await encode(data)
+        except Exception as e:
+            job.skip(row, str(e) or type(e).__name__)
+            return
+
+        async with batch_lock:
+            batch.append((row, {
+                "name": row.name,
+                "roll_number": row.roll_number,
+                "department": row.department,
+                "institute_id": job.institute_id,
+                "face_encoding": face_encoding,
+                "created_at": datetime.utcnow()
+            }))
+            job.processed += 1
+            if len(batch) >= BULK_ENROLL_BATCH_SIZE:
+                await flush()
+
+    async def worker(remaining: Iterator[ManifestRow]):
+        # Workers share one iterator, so a job holds BULK_ENROLL_CONCURRENCY tasks however long the manifest
+        for row in remaining:
+            await enroll(row)
+
+    try:
+        job.state = "running"
+        existing = await run_db(existing_roll_numbers, db, job.institute_id, [row.roll_number for row in rows])
+        to_enroll = []
+        for row in rows:
+            if row.roll_number in existing:
+                job.skip(row, "roll number already registered")
+            else:
+                to_enroll.append(row)
+
+        remaining = iter(to_enroll)
+        tasks = [asyncio.create_task(worker(remaining)) for _ in range(min(BULK_ENROLL_CONCURRENCY, len(to_enroll)))]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        async with batch_lock:
+            await flush()
+        job.state = "completed"
+    except Exception as e:
+        await run_db(db.rollback)
+        job.state = "failed"
+        job.error = str(e)
+        logger.error("Bulk enrollment %s failed: %s", job.id, e)
+    finally:
+        job.finished_at = datetime.utcnow()
+        archive.close()
+        await run_db(db.close)
+        os.unlink(archive_path)
+        logger.info("Bulk enrollment %s %s: %s enrolled, %s skipped", job.id, job.state, job.enrolled, len(job.skipped))
+
+
+enrollment_jobs = EnrollmentJobs()
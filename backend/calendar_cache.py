@@ -0,0 +1,191 @@
+import calendar
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from database import Institute, Holiday
+
+INSTITUTE_CACHE_SIZE = int(os.getenv("INSTITUTE_CACHE_SIZE", "1024"))
+INSTITUTE_CACHE_TTL = float(os.getenv("INSTITUTE_CACHE_TTL", "600"))
+CALENDAR_CACHE_SIZE = int(os.getenv("CALENDAR_CACHE_SIZE", "2048"))
+# Upper bound on how stale a holiday toggled on *another* worker can be here
+CALENDAR_CACHE_TTL = float(os.getenv("CALENDAR_CACHE_TTL", "300"))
+
+WEEKEND_DAYS = (5, 6)
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+class TTLLRUCache:
+    """Small thread-safe LRU whose entries also expire after `ttl` seconds"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[object, Tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def pop_where(self, predicate):
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# ========== INSTITUTE NAME -> ID ==========
+
+class InstituteRef(NamedTuple):
+    id: int
+    name: str
+
+
+def normalize_institute_name(name: str) -> str:
+    return name.strip().lower()
+
+
+class InstituteDirectory:
+    """Case-insensitive institute name lookups without an ilike scan per request"""
+
+    def __init__(self, maxsize: int = INSTITUTE_CACHE_SIZE, ttl: float = INSTITUTE_CACHE_TTL):
+        self._cache = TTLLRUCache(maxsize, ttl)
+
+    def get_cached(self, name: str) -> Optional[InstituteRef]:
+        return self._cache.get(normalize_institute_name(name))
+
+    def lookup(self, db, name: str) -> Optional[InstituteRef]:
+        """Cached lookup, falling back to the database. Misses are not cached - the institute may be created later"""
+        ref = self.get_cached(name)
+        if ref is not None:
+            return ref
+
+        institute = db.query(Institute.id, Institute.name).filter(
+            Institute.name.ilike(name.strip())
+        ).first()
+        if institute is None:
+            return None
+
+        ref = InstituteRef(institute.id, institute.name)
+        self._cache.set(normalize_institute_name(name), ref)
+        return ref
+
+    def invalidate(self, name: Optional[str] = None):
+        if name is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(normalize_institute_name(name))
+
+
+# ========== PER-MONTH HOLIDAY CALENDAR ==========
+
+class DayStatus(NamedTuple):
+    is_holiday: bool
+    reason: str
+    is_custom: bool
+
+
+class MonthCalendar:
+    """One institute-month: a bitmap of holidays (bit d = day d) plus the admin overrides behind it"""
+
+    def __init__(self, year: int, month: int, overrides: Dict[int, Tuple[bool, Optional[str]]]):
+        self.year = year
+        self.month = month
+        self.overrides = overrides
+
+        bits = 0
+        for day in range(1, calendar.monthrange(year, month)[1] + 1):
+            if date(year, month, day).weekday() in WEEKEND_DAYS:
+                bits |= 1 << day
+        for day, (is_holiday, _) in overrides.items():
+            if is_holiday:
+                bits |= 1 << day
+            else:
+                bits &= ~(1 << day)
+        self.holiday_bits = bits
+
+    def is_holiday(self, day: date) -> bool:
+        return bool(self.holiday_bits >> day.day & 1)
+
+    def status(self, day: date) -> DayStatus:
+        """Same priority as before: admin override, then default weekend, then working day"""
+        day_of_week = day.weekday()
+        override = self.overrides.get(day.day)
+
+        if override is not None:
+            is_holiday, reason = override
+            if is_holiday:
+                return DayStatus(True, reason or "Holiday", True)
+            if day_of_week in WEEKEND_DAYS:
+                return DayStatus(False, reason or f"Working Day (Weekend Override: {DAY_NAMES[day_of_week]})", True)
+            return DayStatus(False, reason or "Working Day", True)
+
+        if self.is_holiday(day):
+            return DayStatus(True, DAY_NAMES[day_of_week], False)
+        return DayStatus(False, "Working day", False)
+
+
+class CalendarCache:
+    """MonthCalendar per (institute, year, month); /admin/toggle-holiday invalidates its month"""
+
+    def __init__(self, maxsize: int = CALENDAR_CACHE_SIZE, ttl: float = CALENDAR_CACHE_TTL):
+        self._cache = TTLLRUCache(maxsize, ttl)
+
+    def get_cached(self, institute_id: int, day: date) -> Optional[MonthCalendar]:
+        return self._cache.get((institute_id, day.year, day.month))
+
+    def get(self, db, institute_id: int, day: date) -> MonthCalendar:
+        month_calendar = self.get_cached(institute_id, day)
+        if month_calendar is not None:
+            return month_calendar
+
+        first_day = date(day.year, day.month, 1)
+        last_day = date(day.year, day.month, calendar.monthrange(day.year, day.month)[1])
+        rows = db.query(Holiday.date, Holiday.is_holiday, Holiday.reason).filter(
+            Holiday.institute_id == institute_id,
+            Holiday.date >= first_day,
+            Holiday.date <= last_day
+        ).all()
+
+        month_calendar = MonthCalendar(day.year, day.month, {
+            row.date.day: (bool(row.is_holiday), row.reason) for row in rows
+        })
+        self._cache.set((institute_id, day.year, day.month), month_calendar)
+        return month_calendar
+
+    def invalidate(self, institute_id: int, day: Optional[date] = None):
+        """Forget one month (or every cached month) of an institute's calendar"""
+        if day is not None:
+            self._cache.pop((institute_id, day.year, day.month))
+        else:
+            self._cache.pop_where(lambda key: key[0] == institute_id)
+
+
+institute_directory = InstituteDirectory()
+calendar_cache = CalendarCache()
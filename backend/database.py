@@ -1,19 +1,23 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean, DateTime, Date, Time, ForeignKey, Index
+from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean, DateTime, Date, Time, ForeignKey, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
 import os
+import functools
+from anyio import CapacityLimiter, to_thread
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
 
 engine = create_engine(
     DATABASE_URL,
     pool_pre_ping=True,
-    pool_size=5,
-    max_overflow=10,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
     connect_args={
         "connect_timeout": 10,
         "options": "-c timezone=utc"
@@ -59,13 +63,19 @@ class Student(Base):
     roll_number = Column(String(100), nullable=False)
     department = Column(String(255), nullable=False)
     institute_id = Column(Integer, ForeignKey('institutes.id', ondelete='CASCADE'), nullable=False)
-    face_encoding = Column(Text, nullable=False)
+    face_encoding = Column(LargeBinary, nullable=False)  # Packed float32 vector (see migrations.py)
     photo_url = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
     institute = relationship("Institute", back_populates="students")
     attendance_records = relationship("Attendance", back_populates="student", cascade="all, delete-orphan")
+    
+    # One roll number per institute (also closes the concurrent registration race), and the
+    # index behind roll number lookups, gallery loads and per-institute listings
+    __table_args__ = (
+        Index('idx_student_institute_roll', 'institute_id', 'roll_number', unique=True),
+    )
 
 class Attendance(Base):
     __tablename__ = "attendance"
@@ -81,6 +91,16 @@ class Attendance(Base):
     
     # Relationships
     student = relationship("Student", back_populates="attendance_records")
+    
+    # One mark per student per day (also closes the concurrent check-in race),
+    # plus a date-first index covering the columns the listings and exports read
+    __table_args__ = (
+        Index('idx_attendance_student_date', 'student_id', 'date', unique=True),
+        Index(
+            'idx_attendance_date_student', 'date', 'student_id',
+            postgresql_include=['time', 'status', 'face_match', 'dress_code_match']
+        ),
+    )
 
 class DressCode(Base):
     __tablename__ = "dress_codes"
@@ -89,6 +109,7 @@ class DressCode(Base):
     institute_id = Column(Integer, ForeignKey('institutes.id', ondelete='CASCADE'), nullable=False)
     dress_type = Column(String(100), nullable=False)
     image_data = Column(Text, nullable=False)  # Base64 encoded image
+    clothing_features = Column(Text, nullable=True)  # JSON from /extract-clothing, computed at upload
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -122,9 +143,48 @@ class Holiday(Base):
         Index('idx_institute_date', 'institute_id', 'date', unique=True),
     )
 
+class BackgroundJob(Base):
+    __tablename__ = "background_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(50), nullable=False)  # handler name registered with job_queue
+    payload = Column(Text, nullable=False)  # JSON
+    status = Column(String(20), nullable=False, default="queued")  # queued / running / failed (done rows are deleted)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Workers claim the oldest runnable job
+    __table_args__ = (
+        Index('idx_background_jobs_claim', 'status', 'run_after'),
+    )
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# ========== THREADPOOL OFFLOAD ==========
+# The engine is synchronous, so any Session work inside an `async def` endpoint
+# must go through run_db(). Otherwise one slow query blocks the event loop and
+# stalls every in-flight ML call. Endpoints that only touch the database are
+# plain `def` and FastAPI already runs them in its threadpool.
+
+_db_limiter = None
+
+def get_db_limiter() -> CapacityLimiter:
+    """One DB thread per pooled connection - extra callers wait here, not inside the pool"""
+    global _db_limiter
+    if _db_limiter is None:
+        _db_limiter = CapacityLimiter(DB_POOL_SIZE + DB_MAX_OVERFLOW)
+    return _db_limiter
+
+async def run_db(fn, *args, **kwargs):
+    """Run blocking SQLAlchemy work in a worker thread and await its result"""
+    return await to_thread.run_sync(functools.partial(fn, *args, **kwargs), limiter=get_db_limiter())
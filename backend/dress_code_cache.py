@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import threading
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func
+
+from database import DressCode, run_db
+from image_payload import ImagePayload
+
+logger = logging.getLogger(__name__)
+
+# Same cut-off verify_dress_code passes to /compare-clothing
+CLOTHING_MATCH_THRESHOLD = 0.6
+# "remote" (default) keeps one /compare-clothing call per item; "local" scores every item in-process
+# with ReferenceSet.similarities. The local score is a different metric (histogram cosines run high),
+# so only switch after calibrate_clothing_compare.py shows the two agree at CLOTHING_LOCAL_THRESHOLD.
+CLOTHING_COMPARE_MODE = os.getenv("CLOTHING_COMPARE_MODE", "remote")
+CLOTHING_LOCAL_THRESHOLD = float(os.getenv("CLOTHING_LOCAL_THRESHOLD", str(CLOTHING_MATCH_THRESHOLD)))
+
+
+class DressCodeReference(NamedTuple):
+    id: int
+    dress_type: str
+    features: dict
+
+
+def _flatten_numbers(value, out: list):
+    if value is None or isinstance(value, (bool, str)):
+        return
+    if isinstance(value, (int, float)):
+        out.append(float(value))
+    elif isinstance(value, dict):
+        for key in sorted(value):
+            _flatten_numbers(value[key], out)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _flatten_numbers(item, out)
+
+
+def clothing_feature_vector(features: dict) -> Tuple[tuple, np.ndarray]:
+    """Flatten /extract-clothing output into (layout, vector).
+
+    Each top-level feature group (colour histogram, edge stats, dominant colours...)
+    is L2-normalized on its own and scaled by 1/sqrt(groups), so the dot product of
+    two vectors is the mean per-group cosine similarity - no group dominates just
+    because its raw values are larger.
+    """
+    layout, blocks = [], []
+    for key in sorted(features):
+        values = []
+        _flatten_numbers(features[key], values)
+        if not values:
+            continue
+
+        block = np.asarray(values, dtype=np.float32)
+        norm = np.linalg.norm(block)
+        if norm > 0:
+            block = block / norm
+
+        layout.append((key, len(values)))
+        blocks.append(block)
+
+    if not blocks:
+        return (), np.empty(0, dtype=np.float32)
+
+    return tuple(layout), np.concatenate(blocks) / np.sqrt(len(blocks))
+
+
+class ReferenceSet:
+    """An institute's dress-code items plus their stacked feature matrix"""
+
+    def __init__(self, references: List[DressCodeReference]):
+        self.references = references
+        self.layout = None
+        self.matrix = None
+
+        vectors = [clothing_feature_vector(r.features) for r in references]
+        layouts = {layout for layout, _ in vectors}
+        # Only stack when every reference has the same shape; otherwise callers use /compare-clothing
+        if len(layouts) == 1 and vectors[0][0]:
+            self.layout = vectors[0][0]
+            self.matrix = np.vstack([vector for _, vector in vectors])
+
+    def __len__(self) -> int:
+        return len(self.references)
+
+    def __iter__(self):
+        return iter(self.references)
+
+    def similarities(self, student_features: dict) -> Optional[np.ndarray]:
+        """Similarity of the student photo to every item in one matrix-vector product (None if not comparable)"""
+        if self.matrix is None:
+            return None
+
+        layout, vector = clothing_feature_vector(student_features)
+        if layout != self.layout:
+            return None
+
+        return np.clip(self.matrix @ vector, 0.0, 1.0)
+
+
+class DressCodeCache:
+    """Per-institute reference clothing features.
+
+    Features are extracted once at upload and stored in DressCode.clothing_features,
+    so a check-in only needs /extract-clothing for the student photo. Rows uploaded
+    before that column existed are backfilled the first time they are needed.
+    Like the face galleries, entries carry a (count, max id) stamp that is checked
+    against the database so uploads/deletes on other workers are picked up.
+    """
+
+    def __init__(self):
+        self._entries: Dict[int, Tuple[Tuple[int, int], ReferenceSet]] = {}
+        self._lock = threading.Lock()
+
+    def _version_in_db(self, db, institute_id: int) -> Tuple[int, int]:
+        count, max_id = db.query(func.count(DressCode.id), func.max(DressCode.id)).filter(
+            DressCode.institute_id == institute_id
+        ).one()
+        return int(count or 0), int(max_id or 0)
+
+    def count(self, db, institute_id: int) -> int:
+        """Number of dress code items the institute has (one indexed count, no features loaded)"""
+        return self._version_in_db(db, institute_id)[0]
+
+    async def get(
+        self,
+        db,
+        institute_id: int,
+        extract_features: Callable[[ImagePayload], Awaitable[dict]]
+    ) -> ReferenceSet:
+        """Reference features for an institute, loading (and backfilling) them on a cache miss"""
+        version = await run_db(self._version_in_db, db, institute_id)
+
+        with self._lock:
+            entry = self._entries.get(institute_id)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        # image_data is only read for rows that still need their features extracted
+        rows = await run_db(lambda: db.query(DressCode.id, DressCode.dress_type, DressCode.clothing_features).filter(
+            DressCode.institute_id == institute_id
+        ).order_by(DressCode.id).all())
+
+        references = []
+        for row in rows:
+            if row.clothing_features:
+                features = json.loads(row.clothing_features)
+            else:
+                features = await self._backfill(db, row.id, extract_features)
+            references.append(DressCodeReference(row.id, row.dress_type, features))
+
+        reference_set = ReferenceSet(references)
+        logger.debug("Dress code cache loaded for institute %s: %s items", institute_id, len(reference_set))
+
+        with self._lock:
+            self._entries[institute_id] = (version, reference_set)
+        return reference_set
+
+    async def _backfill(self, db, dress_code_id: int, extract_features) -> dict:
+        image_data = await run_db(
+            lambda: db.query(DressCode.image_data).filter(DressCode.id == dress_code_id).scalar()
+        )
+        features = await extract_features(ImagePayload.from_base64(image_data))
+
+        await run_db(self._store_features, db, dress_code_id, features)
+        logger.debug("Backfilled clothing features for dress code %s", dress_code_id)
+        return features
+
+    @staticmethod
+    def _store_features(db, dress_code_id: int, features: dict):
+        db.query(DressCode).filter(DressCode.id == dress_code_id).update(
+            {DressCode.clothing_features: json.dumps(features)},
+            synchronize_session=False
+        )
+        db.commit()
+
+    def invalidate(self, institute_id: Optional[int] = None):
+        """Forget one institute's references (or all of them)"""
+        with self._lock:
+            if institute_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(institute_id, None)
+
+
+dress_code_cache = DressCodeCache()
@@ -0,0 +1,411 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func
+
+from database import Student
+from ann_index import (
+    IVFIndex, ANN_MIN_GALLERY_SIZE, ANN_RERANK_K, ANN_EXACT_FALLBACK
+)
+
+logger = logging.getLogger(__name__)
+
+# Same cut-off the ML service's /compare-faces uses by default
+FACE_MATCH_THRESHOLD = 0.6
+# "cosine" (default), "euclidean" or "euclidean_l2" - must mirror /compare-faces
+FACE_DISTANCE_METRIC = os.getenv("FACE_DISTANCE_METRIC", "cosine")
+
+NO_MATCH_DISTANCE = 999
+
+
+def parse_face_encoding(encoding) -> np.ndarray:
+    """Turn a face encoding (packed float32 bytes / JSON list / comma separated string / sequence) into a float32 vector"""
+    if isinstance(encoding, (bytes, bytearray, memoryview)):
+        # Stored column format - a zero-copy view over the bytea value
+        return np.frombuffer(encoding, dtype=np.float32)
+
+    if isinstance(encoding, np.ndarray):
+        return encoding.astype(np.float32, copy=False).ravel()
+
+    if isinstance(encoding, str):
+        text = encoding.strip()
+        if text.startswith("["):
+            values = json.loads(text)
+        else:
+            values = [v for v in text.replace(",", " ").split() if v]
+        return np.asarray(values, dtype=np.float32).ravel()
+
+    return np.asarray(encoding, dtype=np.float32).ravel()
+
+
+def face_encoding_to_bytes(encoding) -> bytes:
+    """Pack a face encoding as little-endian float32 for Student.face_encoding"""
+    return parse_face_encoding(encoding).astype("<f4", copy=False).tobytes()
+
+
+def _l2_normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class FaceGallery:
+    """In-memory matrix of one institute's face encodings, searched with a single vectorized distance.
+
+    Rows live in a pre-allocated buffer so registrations append in place and
+    deletions swap the last row into the hole instead of re-stacking the matrix.
+    Once the gallery reaches ANN_MIN_GALLERY_SIZE rows, searches only score the
+    rows in the IVF cells nearest the probe (see ann_index.py). Searches never
+    train the index: GalleryManager does that off the event loop through
+    refresh_index(), and until then an untrained gallery is scanned exactly.
+    """
+
+    def __init__(self, student_ids: Iterable[int], encodings: Iterable, metric: str = FACE_DISTANCE_METRIC,
+                 ann_min_size: int = ANN_MIN_GALLERY_SIZE, index: Optional[IVFIndex] = None):
+        if metric not in ("cosine", "euclidean", "euclidean_l2"):
+            raise ValueError(f"Unsupported face distance metric: {metric}")
+
+        self.metric = metric
+        self.ann_min_size = ann_min_size
+        self._index = index or IVFIndex()
+        self._lock = threading.RLock()
+        self._train_lock = threading.Lock()
+        # Bumped by every add/remove, so build_index can tell whether its snapshot went stale
+        self._generation = 0
+
+        ids = list(student_ids)
+        vectors = [parse_face_encoding(e) for e in encodings]
+        if len(ids) != len(vectors):
+            raise ValueError("student_ids and encodings must have the same length")
+
+        self._size = len(vectors)
+        self._dim = vectors[0].shape[0] if vectors else 0
+        capacity = max(self._size, 16)
+
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._ids[:self._size] = ids
+        # Cosine and L2 metrics only ever need unit vectors, so normalize once up front
+        self._matrix = np.zeros((capacity, self._dim), dtype=np.float32)
+        if vectors:
+            self._matrix[:self._size] = self._prepare(np.vstack(vectors))
+
+        self._rows = {student_id: row for row, student_id in enumerate(ids)}
+        # IVF cell of each row, only meaningful while the index is trained
+        self._labels = np.zeros(capacity, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, student_id: int) -> bool:
+        return student_id in self._rows
+
+    @property
+    def student_ids(self) -> np.ndarray:
+        return self._ids[:self._size]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Search-ready (normalized for cosine / L2) encodings, one row per student"""
+        return self._matrix[:self._size]
+
+    @property
+    def version(self) -> Tuple[int, int]:
+        """(row count, highest student id) - compared against the database to detect drift"""
+        with self._lock:
+            if self._size == 0:
+                return 0, 0
+            return self._size, int(self.student_ids.max())
+
+    def _prepare(self, matrix: np.ndarray) -> np.ndarray:
+        matrix = matrix.astype(np.float32, copy=False)
+        if self.metric == "euclidean" or matrix.size == 0:
+            return matrix
+        return _l2_normalize(matrix)
+
+    def _query(self, probe) -> np.ndarray:
+        query = self._prepare(parse_face_encoding(probe)[np.newaxis, :])[0]
+        if self._size and query.shape[0] != self._dim:
+            raise ValueError(
+                f"Face encoding has {query.shape[0]} dimensions, gallery expects {self._dim}"
+            )
+        return query
+
+    def add(self, student_id: int, encoding):
+        """Append (or replace) one student's encoding in place"""
+        vector = self._prepare(parse_face_encoding(encoding)[np.newaxis, :])[0]
+
+        with self._lock:
+            if self._dim == 0:
+                self._dim = vector.shape[0]
+                self._matrix = np.zeros((len(self._ids), self._dim), dtype=np.float32)
+            elif vector.shape[0] != self._dim:
+                raise ValueError(
+                    f"Face encoding has {vector.shape[0]} dimensions, gallery expects {self._dim}"
+                )
+
+            row = self._rows.get(student_id)
+            if row is None:
+                if self._size == len(self._ids):
+                    self._grow()
+                row = self._size
+                self._size += 1
+                self._ids[row] = student_id
+                self._rows[student_id] = row
+
+            self._matrix[row] = vector
+            self._generation += 1
+            if self._index.is_trained:
+                self._labels[row] = self._index.assign(vector)[0]
+
+    def remove(self, student_id: int) -> bool:
+        """Drop a student's row by moving the last row into its slot"""
+        with self._lock:
+            row = self._rows.pop(student_id, None)
+            if row is None:
+                return False
+
+            last = self._size - 1
+            if row != last:
+                moved_id = int(self._ids[last])
+                self._ids[row] = moved_id
+                self._matrix[row] = self._matrix[last]
+                self._labels[row] = self._labels[last]
+                self._rows[moved_id] = row
+
+            self._size = last
+            self._generation += 1
+            return True
+
+    def _grow(self):
+        capacity = max(16, len(self._ids) * 2)
+
+        ids = np.zeros(capacity, dtype=np.int64)
+        ids[:self._size] = self.student_ids
+        matrix = np.zeros((capacity, self._dim), dtype=np.float32)
+        matrix[:self._size] = self.matrix
+        labels = np.zeros(capacity, dtype=np.int32)
+        labels[:self._size] = self._labels[:self._size]
+
+        self._ids, self._matrix, self._labels = ids, matrix, labels
+
+    @property
+    def uses_ann(self) -> bool:
+        return self._size >= self.ann_min_size
+
+    def build_index(self):
+        """(Re)train the IVF centroids and label every row - seconds of CPU on large galleries.
+
+        k-means runs on a snapshot outside the gallery lock, so searches carry on with
+        the old index (or an exact scan) meanwhile. Call it from a worker thread.
+        Returns False if the gallery changed underneath and the result was dropped.
+        """
+        with self._lock:
+            snapshot = self.matrix.copy()
+            generation = self._generation
+
+        old = self._index
+        index = IVFIndex(old.n_lists, old.n_probe, old.n_iter, old.sample_size, old.seed)
+        index.train(snapshot)
+        labels = index.assign(snapshot)
+
+        with self._lock:
+            if self._generation != generation:
+                # Rows moved while training; the next refresh_index() trains on the new rows
+                logger.debug("IVF index discarded: gallery changed while training")
+                return False
+            self._index = index
+            self._labels[:self._size] = labels
+        logger.debug("IVF index trained: %d cells over %d faces", len(index.centroids), len(snapshot))
+        return True
+
+    def refresh_index(self) -> bool:
+        """Train the IVF index if the gallery crossed ANN_MIN_GALLERY_SIZE or outgrew its centroids.
+
+        Call off the event loop. Returns True if it trained; a refresh already running
+        in another thread makes this a no-op.
+        """
+        if not (self.uses_ann and self._index.needs_retrain(self._size)):
+            return False
+        if not self._train_lock.acquire(blocking=False):
+            return False
+        try:
+            return self.uses_ann and self._index.needs_retrain(self._size) and self.build_index()
+        finally:
+            self._train_lock.release()
+
+    def _distances_to(self, query: np.ndarray, rows) -> np.ndarray:
+        candidates = self._matrix[rows]
+        if self.metric == "cosine":
+            return 1.0 - candidates @ query
+        return np.linalg.norm(candidates - query, axis=1)
+
+    def distances(self, probe) -> np.ndarray:
+        """Exact distance from the probe encoding to every gallery row"""
+        with self._lock:
+            query = self._query(probe)
+            if self._size == 0:
+                return np.empty(0, dtype=np.float32)
+            return self._distances_to(query, slice(0, self._size))
+
+    def search(self, probe, k: int = ANN_RERANK_K, exact: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (student_ids, distances), closest first.
+
+        Small galleries (or exact=True) are scanned in full. Large ones only score
+        the rows in the probed IVF cells - every returned distance is still exact.
+        """
+        with self._lock:
+            query = self._query(probe)
+            if self._size == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+            # An index trained on a smaller gallery is still correct, just less balanced -
+            # keep using it until refresh_index() replaces it
+            if exact or not self.uses_ann or not self._index.is_trained:
+                rows = np.arange(self._size)
+            else:
+                rows = self._index.candidates(query, self._labels[:self._size])
+
+            distances = self._distances_to(query, rows)
+            k = min(k, len(rows))
+            if k == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+            top = np.argpartition(distances, k - 1)[:k]
+            top = top[np.argsort(distances[top])]
+            return self._ids[rows[top]], distances[top]
+
+    def best_match(self, probe, threshold: float = FACE_MATCH_THRESHOLD) -> Tuple[Optional[int], float]:
+        """Return (student_id, distance) of the closest encoding, or (None, 999) if nothing is under threshold"""
+        with self._lock:
+            ids, distances = self.search(probe, k=1)
+
+            # The probed cells can miss a true match near a cell border - confirm with a full scan
+            if self.uses_ann and ANN_EXACT_FALLBACK and (distances.size == 0 or distances[0] > threshold):
+                ids, distances = self.search(probe, k=1, exact=True)
+
+            if distances.size == 0 or distances[0] > threshold:
+                return None, NO_MATCH_DISTANCE
+
+            return int(ids[0]), float(distances[0])
+
+    def match_many(self, probes, threshold: float = FACE_MATCH_THRESHOLD) -> List[Tuple[Optional[int], float]]:
+        """Match every face of a group photo at once.
+
+        One (faces x students) distance matrix over the whole gallery - exact even
+        when the gallery uses ANN - then a greedy closest-first assignment so two
+        faces never claim the same student. Returns (student_id, distance) per
+        probe, (None, 999) where nothing is left under the threshold.
+        """
+        results = [(None, NO_MATCH_DISTANCE)] * len(probes)
+        if not probes:
+            return results
+
+        with self._lock:
+            if self._size == 0:
+                return results
+
+            queries = np.vstack([self._query(probe) for probe in probes])
+            candidates = self.matrix
+            if self.metric == "cosine":
+                distances = 1.0 - queries @ candidates.T
+            else:
+                squared = (
+                    np.einsum("ij,ij->i", queries, queries)[:, np.newaxis]
+                    + np.einsum("ij,ij->i", candidates, candidates)[np.newaxis, :]
+                    - 2.0 * queries @ candidates.T
+                )
+                distances = np.sqrt(np.maximum(squared, 0.0))
+
+            faces, rows = np.nonzero(distances <= threshold)
+            order = np.argsort(distances[faces, rows], kind="stable")
+
+            matched_faces, matched_rows = set(), set()
+            for face, row in zip(faces[order], rows[order]):
+                if face in matched_faces or row in matched_rows:
+                    continue
+                matched_faces.add(face)
+                matched_rows.add(row)
+                results[face] = (int(self._ids[row]), float(distances[face, row]))
+
+            return results
+
+
+# ========== GALLERY MANAGER ==========
+
+class GalleryManager:
+    """Per-institute galleries kept in sync with the students table.
+
+    Registrations and deletions patch the cached gallery directly. Changes made
+    elsewhere (another worker, manual SQL) are caught by comparing the gallery's
+    (count, max id) stamp with the database and rebuilding on mismatch.
+    """
+
+    def __init__(self):
+        self._galleries: Dict[int, FaceGallery] = {}
+        self._lock = threading.Lock()
+
+    def _version_in_db(self, db, institute_id: int) -> Tuple[int, int]:
+        count, max_id = db.query(func.count(Student.id), func.max(Student.id)).filter(
+            Student.institute_id == institute_id
+        ).one()
+        return int(count or 0), int(max_id or 0)
+
+    def load(self, db, institute_id: int) -> FaceGallery:
+        """Build a gallery straight from the students table (id + encoding columns only)"""
+        rows = db.query(Student.id, Student.face_encoding).filter(
+            Student.institute_id == institute_id
+        ).all()
+
+        gallery = FaceGallery([r[0] for r in rows], [r[1] for r in rows])
+        gallery.refresh_index()
+        logger.debug("Face gallery loaded for institute %s: %s students", institute_id, len(gallery))
+
+        with self._lock:
+            self._galleries[institute_id] = gallery
+        return gallery
+
+    def get(self, db, institute_id: int) -> FaceGallery:
+        """Return the institute's gallery, rebuilding it only if it drifted from the database.
+
+        Runs in a worker thread (run_db), so this is also where a grown gallery gets its index retrained.
+        """
+        with self._lock:
+            gallery = self._galleries.get(institute_id)
+
+        if gallery is not None and gallery.version == self._version_in_db(db, institute_id):
+            gallery.refresh_index()
+            return gallery
+
+        return self.load(db, institute_id)
+
+    def add_student(self, institute_id: int, student_id: int, encoding):
+        """Append a freshly committed student; a missing gallery is left to load lazily.
+
+        May retrain the index, so call it from a worker thread.
+        """
+        with self._lock:
+            gallery = self._galleries.get(institute_id)
+        if gallery is not None:
+            gallery.add(student_id, encoding)
+            gallery.refresh_index()
+
+    def remove_student(self, institute_id: int, student_id: int):
+        with self._lock:
+            gallery = self._galleries.get(institute_id)
+        if gallery is not None:
+            gallery.remove(student_id)
+
+    def invalidate(self, institute_id: Optional[int] = None):
+        """Forget one institute's gallery (or all of them)"""
+        with self._lock:
+            if institute_id is None:
+                self._galleries.clear()
+            else:
+                self._galleries.pop(institute_id, None)
+
+
+gallery_manager = GalleryManager()
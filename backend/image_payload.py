@@ -0,0 +1,115 @@
+import base64
+import io
+import logging
+import os
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Longest side photos are scaled down to before any ML call (0 keeps the original upload)
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "640"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+_pillow_warned = False
+
+
+class ImagePayload:
+    """One uploaded image, base64-encoded at most once per request.
+
+    Every ML helper takes the same payload object, so a 3 MB camera frame is
+    turned into a single ~4 MB base64 string instead of one per ML call.
+    """
+
+    def __init__(self, data: Optional[bytes] = None, image_base64: Optional[str] = None):
+        if data is None and image_base64 is None:
+            raise ValueError("ImagePayload needs raw bytes or a base64 string")
+        self._data = data
+        self._base64 = image_base64
+
+    @classmethod
+    def wrap(cls, image: Union["ImagePayload", bytes]) -> "ImagePayload":
+        """Accept either a payload or raw bytes (older call sites)"""
+        if isinstance(image, ImagePayload):
+            return image
+        return cls(data=image)
+
+    @classmethod
+    def from_base64(cls, image_base64: str) -> "ImagePayload":
+        """Wrap an already-encoded image (e.g. DressCode.image_data) without decoding it"""
+        return cls(image_base64=image_base64)
+
+    @property
+    def data(self) -> bytes:
+        if self._data is None:
+            self._data = base64.b64decode(self._base64)
+        return self._data
+
+    @property
+    def base64(self) -> str:
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self._data).decode('utf-8')
+        return self._base64
+
+    def preprocessed(self, max_side: int = IMAGE_MAX_SIDE, quality: int = IMAGE_JPEG_QUALITY) -> "ImagePayload":
+        """Decode once, downscale so the longest side is at most max_side, re-encode as JPEG.
+
+        JPEGs are decoded in draft mode, so libjpeg scales a 12 MP frame down by
+        1/2-1/8 while decoding instead of materializing every pixel. EXIF rotation
+        is applied because the re-encoded file carries no EXIF. Images that are
+        already small JPEGs are returned untouched (no second lossy pass). Needs
+        Pillow; without it - or for undecodable data - the original is returned.
+        CPU-bound: call it off the event loop.
+        """
+        global _pillow_warned
+        if max_side <= 0:
+            return self
+
+        try:
+            from PIL import Image, ImageOps
+        except ImportError:
+            if not _pillow_warned:
+                logger.warning("Pillow is not installed - images are sent to the ML service unresized")
+                _pillow_warned = True
+            return self
+
+        try:
+            with Image.open(io.BytesIO(self.data)) as img:
+                if img.format == "JPEG" and max(img.size) <= max_side:
+                    return self
+
+                img.draft("RGB", (max_side, max_side))
+                img = ImageOps.exif_transpose(img)
+                if img.mode != "RGB":
+                    img = img.convert("RGB")
+                img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+                output = io.BytesIO()
+                img.save(output, format="JPEG", quality=quality)
+        except Exception as e:
+            logger.warning("Image preprocessing skipped: %s", e)
+            return self
+
+        return ImagePayload(data=output.getvalue())
+
+    def as_request(self) -> dict:
+        """JSON body expected by the ML service image endpoints"""
+        return {"image_base64": self.base64}
+
+    @property
+    def size(self) -> int:
+        """Raw image size in bytes"""
+        if self._data is not None:
+            return len(self._data)
+        # Decoded length without actually decoding
+        return len(self._base64) * 3 // 4 - self._base64[-2:].count("=")
+
+    @property
+    def memory_bytes(self) -> int:
+        """Bytes currently held for this image (raw + base64 copies that exist)"""
+        total = len(self._data) if self._data is not None else 0
+        if self._base64 is not None:
+            total += len(self._base64)
+        return total
+
+    def __repr__(self) -> str:
+        return f"ImagePayload(size={self.size}, memory_bytes={self.memory_bytes})"
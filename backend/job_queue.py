@@ -0,0 +1,229 @@
+import asyncio
+import json
+import logging
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import and_, func, or_
+
+from app_logging import current_request_id, log_context
+from database import BackgroundJob, SessionLocal, run_db
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Idle workers re-check the table this often (jobs enqueued by this process wake them at once)
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# Retry n waits about JOB_RETRY_BACKOFF * 2^(n-1) seconds
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "5"))
+# A job still "running" after this long belonged to a worker that died - claim it again
+JOB_LOCK_TIMEOUT = float(os.getenv("JOB_LOCK_TIMEOUT", "300"))
+
+
+class ClaimedJob(NamedTuple):
+    id: int
+    kind: str
+    payload: dict
+    attempts: int
+    max_attempts: int
+
+
+class JobQueue:
+    """Durable background jobs in the background_jobs table, run by in-process asyncio workers.
+
+    Jobs are inserted in the same transaction as the rows they follow up on, so
+    a committed request always has its job. Any number of app workers can poll
+    the table: claims use SELECT .. FOR UPDATE SKIP LOCKED. Finished jobs are
+    deleted; failing ones are retried with exponential backoff and kept as
+    "failed" once they run out of attempts. A handler's on_give_up hook then
+    records the permanent failure on the rows it follows up on, and its
+    discard_on_failure payload fields (e.g. an uploaded image) are dropped.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, poll_interval: float = JOB_POLL_INTERVAL):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._handlers: Dict[str, Callable[[dict], Awaitable[None]]] = {}
+        self._give_up_hooks: Dict[str, Callable[[dict, str], Awaitable[None]]] = {}
+        self._discard_fields: Dict[str, tuple] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def register(self, kind: str, handler: Callable[[dict], Awaitable[None]],
+                 on_give_up: Optional[Callable[[dict, str], Awaitable[None]]] = None,
+                 discard_on_failure: Iterable[str] = ()):
+        """on_give_up(payload, error) runs once the job has failed its last attempt"""
+        self._handlers[kind] = handler
+        if on_give_up is not None:
+            self._give_up_hooks[kind] = on_give_up
+        self._discard_fields[kind] = tuple(discard_on_failure)
+
+    def new_job(self, kind: str, payload: dict, max_attempts: int = JOB_MAX_ATTEMPTS) -> BackgroundJob:
+        """A job row to add to the caller's session; call notify() after the commit.
+
+        The enqueuing request's id rides along so the job's log lines can be tied back to it.
+        """
+        now = datetime.utcnow()
+        request_id = current_request_id()
+        if request_id:
+            payload = {**payload, "request_id": request_id}
+        return BackgroundJob(
+            kind=kind,
+            payload=json.dumps(payload),
+            status="queued",
+            attempts=0,
+            max_attempts=max_attempts,
+            run_after=now,
+            created_at=now,
+            updated_at=now
+        )
+
+    def notify(self):
+        """Wake an idle worker of this process (other processes pick the job up on their next poll)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        logger.info("Job queue started: %s workers, handlers: %s", self.workers, ', '.join(self._handlers))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _claim(self) -> Optional[ClaimedJob]:
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            job = db.query(BackgroundJob).filter(
+                BackgroundJob.kind.in_(list(self._handlers)),
+                or_(
+                    and_(BackgroundJob.status == "queued", BackgroundJob.run_after <= now),
+                    and_(
+                        BackgroundJob.status == "running",
+                        BackgroundJob.locked_at < now - timedelta(seconds=JOB_LOCK_TIMEOUT)
+                    )
+                )
+            ).order_by(BackgroundJob.run_after, BackgroundJob.id).with_for_update(skip_locked=True).first()
+
+            if job is None:
+                db.rollback()
+                return None
+
+            job.status = "running"
+            job.locked_at = now
+            job.attempts += 1
+            job.updated_at = now
+            claimed = ClaimedJob(job.id, job.kind, json.loads(job.payload), job.attempts, job.max_attempts)
+            db.commit()
+            return claimed
+        finally:
+            db.close()
+
+    def _complete(self, job_id: int):
+        db = SessionLocal()
+        try:
+            db.query(BackgroundJob).filter(BackgroundJob.id == job_id).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _fail(self, job: ClaimedJob, error: str):
+        now = datetime.utcnow()
+        values = {BackgroundJob.last_error: error, BackgroundJob.locked_at: None, BackgroundJob.updated_at: now}
+        if job.attempts >= job.max_attempts:
+            values[BackgroundJob.status] = "failed"
+            # Failed rows are kept for inspection - without their bulky inputs
+            discard = self._discard_fields.get(job.kind, ())
+            values[BackgroundJob.payload] = json.dumps({k: v for k, v in job.payload.items() if k not in discard})
+        else:
+            backoff = JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1) * random.uniform(0.5, 1.5)
+            values[BackgroundJob.status] = "queued"
+            values[BackgroundJob.run_after] = now + timedelta(seconds=backoff)
+
+        db = SessionLocal()
+        try:
+            db.query(BackgroundJob).filter(BackgroundJob.id == job.id).update(values, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _release(self, job_id: int):
+        """Hand an interrupted job back without counting the attempt (shutdown mid-job)"""
+        db = SessionLocal()
+        try:
+            db.query(BackgroundJob).filter(BackgroundJob.id == job_id).update({
+                BackgroundJob.status: "queued",
+                BackgroundJob.attempts: BackgroundJob.attempts - 1,
+                BackgroundJob.locked_at: None
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    async def _worker(self, number: int):
+        while True:
+            try:
+                job = await run_db(self._claim)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Job worker %s could not claim a job: %s", number, e)
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            with log_context(job.payload.get("request_id") or f"job-{job.id}"):
+                try:
+                    with timed(f"job_{job.kind}"):
+                        await self._handlers[job.kind](job.payload)
+                except asyncio.CancelledError:
+                    await asyncio.to_thread(self._release, job.id)
+                    raise
+                except Exception as e:
+                    giving_up = job.attempts >= job.max_attempts
+                    logger.log(
+                        logging.ERROR if giving_up else logging.WARNING,
+                        "Job %s (%s) attempt %s/%s failed, %s: %s", job.id, job.kind, job.attempts, job.max_attempts,
+                        "giving up" if giving_up else "will retry", e
+                    )
+                    error = str(e) or type(e).__name__
+                    await run_db(self._fail, job, error)
+                    if giving_up:
+                        await self._give_up(job, error)
+                    continue
+
+                await run_db(self._complete, job.id)
+                logger.debug("Job %s (%s) done", job.id, job.kind)
+
+    async def _give_up(self, job: ClaimedJob, error: str):
+        hook = self._give_up_hooks.get(job.kind)
+        if hook is None:
+            return
+        try:
+            await hook(job.payload, error)
+        except Exception as e:
+            logger.error("Job %s (%s) give-up hook failed: %s", job.id, job.kind, e)
+
+    def counts(self, db) -> Dict[str, int]:
+        """Jobs per status (done jobs are deleted, so this is the backlog)"""
+        rows = db.query(BackgroundJob.status, func.count(BackgroundJob.id)).group_by(BackgroundJob.status).all()
+        return {status: count for status, count in rows}
+
+
+job_queue = JobQueue()
@@ -1,30 +1,70 @@
-from fastapi import FastAPI, File, UploadFile, Form, Depends, HTTPException, status, Request
+from fastapi import FastAPI, File, UploadFile, Form, Depends, HTTPException, status, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from fastapi.security import HTTPBasic
+from sqlalchemy import null
 from sqlalchemy.orm import Session
-import io
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import json
-import base64
+import logging
+import shutil
+import tempfile
+import zipfile
+import asyncio
+import time
 from datetime import datetime, date, timedelta
 from typing import List, Optional
-import secrets
+from contextlib import asynccontextmanager
 import hashlib
 import os
 import random
 import string
-import pandas as pd
-from io import BytesIO
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from dotenv import load_dotenv
 import sib_api_v3_sdk
 from sib_api_v3_sdk.rest import ApiException
 import httpx
 
-from database import get_db, Student, Attendance, Admin, Institute, DressCode, PasswordResetToken, Holiday
+from database import engine, get_db, get_db_limiter, run_db, SessionLocal, Student, Attendance, Admin, Institute, DressCode, PasswordResetToken, Holiday
+from face_gallery import gallery_manager, face_encoding_to_bytes, FACE_MATCH_THRESHOLD
+from image_payload import ImagePayload, IMAGE_MAX_SIDE
+from calendar_cache import institute_directory, calendar_cache
+from attendance_export import write_attendance_xlsx, write_attendance_parquet, iter_attendance_csv, iter_file_chunks
+from dress_code_cache import dress_code_cache, CLOTHING_MATCH_THRESHOLD, CLOTHING_LOCAL_THRESHOLD, CLOTHING_COMPARE_MODE
+from ml_resilience import ml_resilience, CircuitOpenError
+from micro_batcher import MicroBatcher, BatcherOverloaded
+from bulk_enrollment import (
+    EnrollmentJob, enrollment_jobs, run_enrollment, index_photos, find_manifest, parse_manifest, read_member
+)
+from job_queue import job_queue
+from metrics import (
+    registry, timed, gauge, instrument_engine, CONTENT_TYPE,
+    http_request_duration, ml_request_duration, ml_errors, ml_in_flight, log_records_per_request
+)
+from attendance_feed import attendance_feed, attendance_event, format_sse, load_events_since
+from app_logging import configure_logging, log_context, new_request_id, REQUEST_ID_HEADER
 
 load_dotenv()
+configure_logging()
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the shared ML service client and start the background workers on startup; stop them on shutdown"""
+    await start_ml_client()
+    face_batcher.start()
+    # The dress code check is the only job kind; without it the queue (and its table) stays unused
+    if DRESS_CODE_CHECK == "background":
+        job_queue.start()
+    try:
+        yield
+    finally:
+        await job_queue.stop()
+        await face_batcher.stop()
+        await close_ml_client()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -41,6 +81,33 @@ app.add_middleware(
 async def options_handler(full_path: str):
     return {"message": "OK"}
 
+# ========== REQUEST CONTEXT AND METRICS ==========
+
+instrument_engine(engine)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Tag the request's log lines with an X-Request-ID (echoed back) and record its latency
+    by route template (streaming responses: time until the body starts)"""
+    request_id = new_request_id(request.headers.get(REQUEST_ID_HEADER))
+    start = time.perf_counter()
+    status_code = 500
+    with log_context(request_id) as context:
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            response.headers[REQUEST_ID_HEADER] = request_id
+            return response
+        finally:
+            route = request.scope.get("route")
+            http_request_duration.observe(
+                time.perf_counter() - start,
+                method=request.method,
+                route=getattr(route, "path", "unmatched"),
+                status=status_code
+            )
+            log_records_per_request.observe(context.records)
+
 security = HTTPBasic()
 
 # Configuration
@@ -51,51 +118,203 @@ SENDER_NAME = os.getenv("SENDER_NAME", "Smart Attendance System")
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
 ML_SERVICE_URL = os.getenv("ML_SERVICE_URL", "https://unkillableronin-smart-attendance-ml.hf.space")
 
+# ML service connection pool
+ML_POOL_MAX_CONNECTIONS = int(os.getenv("ML_POOL_MAX_CONNECTIONS", "50"))
+ML_POOL_MAX_KEEPALIVE = int(os.getenv("ML_POOL_MAX_KEEPALIVE", "20"))
+ML_KEEPALIVE_EXPIRY = float(os.getenv("ML_KEEPALIVE_EXPIRY", "60"))
+ML_CONNECT_TIMEOUT = float(os.getenv("ML_CONNECT_TIMEOUT", "10"))
+ML_READ_TIMEOUT = float(os.getenv("ML_READ_TIMEOUT", "60"))
+ML_POOL_TIMEOUT = float(os.getenv("ML_POOL_TIMEOUT", "10"))
+ML_HTTP2 = os.getenv("ML_HTTP2", "false").lower() in ["true", "1", "yes"]
+
+# Face extraction micro-batching (ML_FACE_BATCH_SIZE=1 sends every image on its own)
+ML_FACE_BATCH_ENDPOINT = os.getenv("ML_FACE_BATCH_ENDPOINT", "/extract-face-batch")
+ML_FACE_BATCH_SIZE = int(os.getenv("ML_FACE_BATCH_SIZE", "16"))
+ML_FACE_BATCH_WAIT_MS = float(os.getenv("ML_FACE_BATCH_WAIT_MS", "5"))
+ML_FACE_BATCH_MAX_PENDING = int(os.getenv("ML_FACE_BATCH_MAX_PENDING", "256"))
+ML_FACE_BATCH_CONCURRENCY = int(os.getenv("ML_FACE_BATCH_CONCURRENCY", "4"))
+ML_FACE_BATCH_TIMEOUT = float(os.getenv("ML_FACE_BATCH_TIMEOUT", "30"))
+
+# Group (classroom) photos: every face in one image
+ML_FACES_ENDPOINT = os.getenv("ML_FACES_ENDPOINT", "/extract-faces")
+# Faces are small in a classroom shot, so group photos keep more resolution than selfies
+IMAGE_GROUP_MAX_SIDE = int(os.getenv("IMAGE_GROUP_MAX_SIDE", "1600"))
+GROUP_ATTENDANCE_STATUS = "Present - Group Photo"
+
+# "inline" (default): the dress code is verified before responding, as before. "background": check-ins
+# are recorded as "Present" at once and a queued job (job_queue.py) settles the verdict - needs the
+# background_jobs table, so run `python migrations.py job_queue` before switching
+DRESS_CODE_CHECK = os.getenv("DRESS_CODE_CHECK", "inline")
+DRESS_CODE_JOB = "verify_dress_code"
+# A background check that ran out of retries: the student stays present, dress_code_match stays NULL
+DRESS_CODE_UNCHECKED_STATUS = "Present - Dress Code Not Checked"
+
 # ========== ML SERVICE CLIENT ==========
 
-async def call_ml_service(endpoint: str, data: dict) -> dict:
-    """Call ML service on Hugging Face"""
+ml_client: Optional[httpx.AsyncClient] = None
+
+def create_ml_client() -> httpx.AsyncClient:
+    """Build the pooled keep-alive client used for every ML service call"""
+    http2 = ML_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401 - httpx needs it for HTTP/2
+        except ImportError:
+            logger.warning("ML_HTTP2 is set but the 'h2' package is not installed - using HTTP/1.1")
+            http2 = False
+
+    return httpx.AsyncClient(
+        base_url=ML_SERVICE_URL,
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=ML_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=ML_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=ML_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(
+            connect=ML_CONNECT_TIMEOUT,
+            read=ML_READ_TIMEOUT,
+            write=ML_READ_TIMEOUT,
+            pool=ML_POOL_TIMEOUT
+        )
+    )
+
+async def start_ml_client():
+    global ml_client
+    if ml_client is None or ml_client.is_closed:
+        ml_client = create_ml_client()
+        logger.info("ML client ready: %s (max_connections=%s)", ML_SERVICE_URL, ML_POOL_MAX_CONNECTIONS)
+
+async def close_ml_client():
+    global ml_client
+    if ml_client is not None:
+        await ml_client.aclose()
+        ml_client = None
+
+def get_ml_client() -> httpx.AsyncClient:
+    """Shared client - created lazily if the app was started without its lifespan"""
+    global ml_client
+    if ml_client is None or ml_client.is_closed:
+        ml_client = create_ml_client()
+    return ml_client
+
+class MLEndpointMissing(Exception):
+    """The ML service does not expose an optional endpoint (404/405)"""
+
+async def call_ml_service(endpoint: str, data: dict, optional: bool = False) -> dict:
+    """Call ML service on Hugging Face (optional=True raises MLEndpointMissing on 404/405)"""
+    start = time.perf_counter()
+    ml_in_flight.inc()
     try:
-        print(f"[DEBUG] Calling ML service: {endpoint}")
+        logger.debug("Calling ML service: %s", endpoint)
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                f"{ML_SERVICE_URL}{endpoint}",
-                json=data
-            )
-            response.raise_for_status()
-            result = response.json()
-            
-            print(f"[DEBUG] ML service response: {result.get('status', 'unknown')}")
-            return result
-            
-    except httpx.TimeoutException:
-        print(f"[ERROR] ML service timeout")
+        response = await ml_resilience.post(lambda: get_ml_client().post(endpoint, json=data), endpoint)
+        response.raise_for_status()
+        result = response.json()
+        
+        logger.debug("ML service response: %s", result.get('status', 'unknown'))
+        return result
+        
+    except httpx.HTTPStatusError as e:
+        ml_errors.inc(endpoint=endpoint, status=e.response.status_code)
+        if optional and e.response.status_code in (404, 405):
+            raise MLEndpointMissing(endpoint)
+        logger.error("ML service HTTP error: %s", e)
+        raise HTTPException(
+            status_code=503,
+            detail="ML service is currently unavailable. Please try again later."
+        )
+    except CircuitOpenError:
+        ml_errors.inc(endpoint=endpoint, status="circuit_open")
+        logger.error("ML service circuit open - failing fast: %s", endpoint)
+        raise HTTPException(
+            status_code=503,
+            detail="ML service is temporarily unavailable. Please try again shortly."
+        )
+    except (httpx.TimeoutException, asyncio.TimeoutError):
+        ml_errors.inc(endpoint=endpoint, status="timeout")
+        logger.error("ML service timeout")
         raise HTTPException(
             status_code=504,
             detail="ML service is taking too long. Please try again."
         )
     except httpx.HTTPError as e:
-        print(f"[ERROR] ML service HTTP error: {e}")
+        ml_errors.inc(endpoint=endpoint, status="transport")
+        logger.error("ML service HTTP error: %s", e)
         raise HTTPException(
             status_code=503,
             detail="ML service is currently unavailable. Please try again later."
         )
     except Exception as e:
-        print(f"[ERROR] ML service error: {str(e)}")
+        ml_errors.inc(endpoint=endpoint, status="error")
+        logger.error("ML service error: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"ML service error: {str(e)}"
         )
+    finally:
+        ml_in_flight.dec()
+        ml_request_duration.observe(time.perf_counter() - start, endpoint=endpoint)
+
+# Flipped off the first time the ML service answers 404/405 for the batch endpoint
+face_batch_supported = True
+
+async def extract_face_batch(images: List[ImagePayload]) -> list:
+    """Raw /extract-face results for a batch of images, in order.
+
+    Uses the batch endpoint when the ML service has one; otherwise (or for a
+    single image) the images go to /extract-face concurrently over the pool.
+    """
+    global face_batch_supported
+    
+    if len(images) > 1 and face_batch_supported:
+        try:
+            result = await call_ml_service(
+                ML_FACE_BATCH_ENDPOINT,
+                {"images": [image.base64 for image in images]},
+                optional=True
+            )
+            results = result.get("results")
+            if result.get("status") == "error" or not isinstance(results, list) or len(results) != len(images):
+                raise HTTPException(status_code=503, detail=result.get("message", "Batch face extraction failed"))
+            logger.debug("Face extraction batch of %s", len(images))
+            return results
+        except MLEndpointMissing:
+            logger.warning("ML service has no %s - sending face images one by one", ML_FACE_BATCH_ENDPOINT)
+            face_batch_supported = False
+    
+    return await asyncio.gather(
+        *(call_ml_service("/extract-face", image.as_request()) for image in images),
+        return_exceptions=True
+    )
+
+face_batcher = MicroBatcher(
+    extract_face_batch,
+    max_batch_size=ML_FACE_BATCH_SIZE,
+    max_wait=ML_FACE_BATCH_WAIT_MS / 1000,
+    max_pending=ML_FACE_BATCH_MAX_PENDING,
+    max_concurrency=ML_FACE_BATCH_CONCURRENCY,
+    timeout=ML_FACE_BATCH_TIMEOUT,
+    name="face batcher"
+)
 
-async def extract_face_encoding(image_bytes: bytes) -> str:
-    """Extract face encoding via ML service"""
+async def extract_face_encoding(image) -> str:
+    """Extract face encoding via ML service (image: ImagePayload or raw bytes), batched with concurrent calls"""
     try:
-        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-        
-        result = await call_ml_service("/extract-face", {
-            "image_base64": image_base64
-        })
+        try:
+            result = await face_batcher.submit(ImagePayload.wrap(image))
+        except BatcherOverloaded:
+            logger.warning("Face extraction queue full (%s waiting)", face_batcher.pending)
+            raise HTTPException(
+                status_code=503,
+                detail="Too many check-ins at once. Please try again in a moment."
+            )
+        except asyncio.TimeoutError:
+            logger.error("Face extraction timed out after %ss", ML_FACE_BATCH_TIMEOUT)
+            raise HTTPException(
+                status_code=504,
+                detail="ML service is taking too long. Please try again."
+            )
         
         if result["status"] == "error":
             message = result.get("message", "Face detection failed")
@@ -115,37 +334,29 @@ async def extract_face_encoding(image_bytes: bytes) -> str:
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[ERROR] Face extraction failed: {str(e)}")
+        logger.error("Face extraction failed: %s", e)
         raise Exception(f"{str(e)}")
 
-async def compare_faces(encoding1_str: str, encoding2_str: str, threshold: float = 0.6) -> tuple:
-    """Compare two face encodings via ML service"""
+async def extract_all_face_encodings(image: ImagePayload) -> list:
+    """Every face in a group photo as [{"face_encoding": ..., "location": [top, right, bottom, left] or None}]"""
     try:
-        result = await call_ml_service("/compare-faces", {
-            "encoding1": encoding1_str,
-            "encoding2": encoding2_str,
-            "threshold": threshold
-        })
-        
-        if result["status"] == "error":
-            return False, 999
-        
-        return result["is_match"], result["distance"]
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"[ERROR] Face comparison failed: {str(e)}")
-        return False, 999
-
-async def extract_clothing_features(image_bytes: bytes) -> dict:
-    """Extract clothing features via ML service"""
+        result = await call_ml_service(ML_FACES_ENDPOINT, image.as_request(), optional=True)
+    except MLEndpointMissing:
+        raise Exception("Group attendance is not supported by the ML service (no multi-face endpoint)")
+    
+    if result["status"] == "error":
+        raise Exception(result.get("message", "Face detection failed"))
+    
+    faces = result.get("faces") or []
+    return [
+        {"face_encoding": face["face_encoding"], "location": face.get("location")}
+        for face in faces
+    ]
+
+async def extract_clothing_features(image) -> dict:
+    """Extract clothing features via ML service (image: ImagePayload or raw bytes)"""
     try:
-        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-        
-        result = await call_ml_service("/extract-clothing", {
-            "image_base64": image_base64
-        })
+        result = await call_ml_service("/extract-clothing", ImagePayload.wrap(image).as_request())
         
         if result["status"] == "error":
             raise Exception(result["message"])
@@ -155,7 +366,7 @@ async def extract_clothing_features(image_bytes: bytes) -> dict:
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[ERROR] Clothing extraction failed: {str(e)}")
+        logger.error("Clothing extraction failed: %s", e)
         raise Exception(f"Clothing feature extraction failed: {str(e)}")
 
 async def compare_clothing(student_features: dict, reference_features: dict, threshold: float = 0.6) -> tuple:
@@ -175,29 +386,42 @@ async def compare_clothing(student_features: dict, reference_features: dict, thr
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[ERROR] Clothing comparison failed: {str(e)}")
+        logger.error("Clothing comparison failed: %s", e)
         return False, 0.0
 
-async def verify_dress_code(student_photo_bytes: bytes, dress_codes, db: Session) -> tuple:
-    """Verify dress code compliance via ML service"""
+async def verify_dress_code(student_photo, institute_id: int, db: Session) -> tuple:
+    """Verify dress code compliance via ML service against the institute's cached reference features"""
     try:
+        dress_codes = await dress_code_cache.get(db, institute_id, extract_clothing_features)
+        
         if not dress_codes or len(dress_codes) == 0:
-            print("[DEBUG] No dress codes defined - auto-passing")
+            logger.debug("No dress codes defined - auto-passing")
             return True, {"message": "No dress code requirements", "items": []}
         
-        print(f"[DEBUG] Checking {len(dress_codes)} dress code items")
+        logger.debug("Checking %s dress code items", len(dress_codes))
         
-        student_features = await extract_clothing_features(student_photo_bytes)
+        student_features = await extract_clothing_features(student_photo)
+        
+        # All items scored at once against the stacked reference matrix
+        similarities = None
+        if CLOTHING_COMPARE_MODE == "local":
+            similarities = dress_codes.similarities(student_features)
+            if similarities is None:
+                logger.warning("Clothing features not comparable locally - using /compare-clothing")
+        
+        if similarities is not None:
+            scores = [(float(s) >= CLOTHING_LOCAL_THRESHOLD, float(s)) for s in similarities]
+        else:
+            # One /compare-clothing call per item, all in flight at once
+            scores = await asyncio.gather(*(
+                compare_clothing(student_features, dress_code.features, threshold=CLOTHING_MATCH_THRESHOLD)
+                for dress_code in dress_codes
+            ))
         
         verification_results = []
         all_matched = True
         
-        for dress_code in dress_codes:
-            reference_bytes = base64.b64decode(dress_code.image_data)
-            reference_features = await extract_clothing_features(reference_bytes)
-            
-            is_match, similarity = await compare_clothing(student_features, reference_features, threshold=0.6)
-            
+        for dress_code, (is_match, similarity) in zip(dress_codes, scores):
             verification_results.append({
                 "dress_type": dress_code.dress_type,
                 "matched": bool(is_match),
@@ -218,9 +442,160 @@ async def verify_dress_code(student_photo_bytes: bytes, dress_codes, db: Session
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[ERROR] Dress code verification error: {str(e)}")
+        logger.error("Dress code verification error: %s", e)
         return True, {"error": str(e), "message": "Dress code check skipped due to error"}
 
+async def run_dress_code_job(payload: dict):
+    """Background half of a check-in: verify the dress code and settle the provisional attendance row"""
+    db = SessionLocal()
+    try:
+        image = ImagePayload.from_base64(payload["image_base64"])
+        compliant, details = await verify_dress_code(image, payload["institute_id"], db)
+        if "error" in details:
+            # Inline checks auto-pass on errors; here the job can simply be retried
+            raise Exception(details["error"])
+        
+        status = "Present" if compliant else "Present - Dress Code Violation"
+        row = await run_db(settle_dress_code, db, payload["attendance_id"], status, compliant)
+    finally:
+        await run_db(db.close)
+    
+    if row is None:
+        logger.debug("Attendance %s was deleted before its dress code check finished", payload['attendance_id'])
+        return
+    
+    logger.debug("Dress code settled for attendance %s: %s", row.id, status)
+    attendance_feed.publish(payload["institute_id"], attendance_event(*row, event="attendance_update"))
+
+async def give_up_dress_code_job(payload: dict, error: str):
+    """Out of retries: mark the row as not checked so it no longer looks pending"""
+    db = SessionLocal()
+    try:
+        row = await run_db(settle_dress_code, db, payload["attendance_id"], DRESS_CODE_UNCHECKED_STATUS, None)
+    finally:
+        await run_db(db.close)
+    
+    if row is not None:
+        logger.warning("Dress code for attendance %s could not be checked: %s", row.id, error)
+        attendance_feed.publish(payload["institute_id"], attendance_event(*row, event="attendance_update"))
+
+job_queue.register(
+    DRESS_CODE_JOB, run_dress_code_job,
+    on_give_up=give_up_dress_code_job, discard_on_failure=("image_base64",)
+)
+
+async def prepare_image(data: bytes, max_side: int = IMAGE_MAX_SIDE) -> ImagePayload:
+    """Downscale/re-encode an upload once (in a worker thread) before it goes to any ML endpoint"""
+    original = ImagePayload(data)
+    with timed("image_preprocess"):
+        image = await asyncio.to_thread(original.preprocessed, max_side)
+    if image is not original:
+        logger.debug("Image preprocessed: %s -> %s bytes", original.size, image.size)
+    return image
+
+# ========== PRE-MATCH CHECKS ==========
+# Each check returns a rejection message, or None when the photo passes (or the
+# check is unavailable and skipped). 503/504 from the ML service still propagate.
+
+async def check_liveness(image: ImagePayload) -> Optional[str]:
+    """Reject printed photos / screens held up to the camera"""
+    try:
+        liveness_result = await call_ml_service("/check-liveness", image.as_request())
+
+        if liveness_result.get("status") == "success":
+            is_live = liveness_result.get("is_live", True)
+            liveness_score = liveness_result.get("score", 1.0)
+            logger.debug("Liveness: is_live=%s, score=%.2f", is_live, liveness_score)
+
+            if not is_live:
+                return (
+                    "Liveness check failed! A photo or screen was detected. "
+                    "Please use a live face for attendance."
+                )
+        else:
+            logger.warning("Liveness check returned error - skipping: %s", liveness_result.get('message'))
+
+    except HTTPException as e:
+        if e.status_code in [503, 504]:
+            raise
+        logger.warning("Liveness endpoint not available - skipping liveness check")
+
+    return None
+
+async def check_face_covered(image: ImagePayload) -> Optional[str]:
+    """Reject faces covered by a mask, scarf, hands, etc."""
+    try:
+        face_covered_result = await call_ml_service("/check-face-covered", image.as_request())
+
+        if face_covered_result.get("status") == "success":
+            is_covered = face_covered_result.get("is_covered", False)
+            logger.debug("Face covered check: is_covered=%s", is_covered)
+
+            if is_covered:
+                return (
+                    "Face is covered or masked! Please remove any mask, "
+                    "scarf, or obstruction and try again."
+                )
+        else:
+            logger.warning("Face covered check returned error - skipping: %s", face_covered_result.get('message'))
+
+    except HTTPException as e:
+        if e.status_code in [503, 504]:
+            raise
+        logger.warning("Face covered endpoint not available - skipping check")
+
+    return None
+
+async def check_screen_proxy(image: ImagePayload) -> Optional[str]:
+    """Reject a phone/screen showing another person's face.
+
+    Works alongside liveness but specifically targets screen artifacts
+    (moire patterns, screen glare, pixel grid).
+    """
+    try:
+        screen_result = await call_ml_service("/check-screen-proxy", image.as_request())
+
+        if screen_result.get("status") == "success":
+            is_screen = screen_result.get("is_screen", False)
+            confidence = screen_result.get("confidence", 0.0)
+            logger.debug("Screen proxy check: is_screen=%s, confidence=%.2f", is_screen, confidence)
+
+            if is_screen:
+                return (
+                    "Mobile proxy attendance detected! A screen or device "
+                    "was detected instead of a live face. "
+                    "Please appear in person for attendance."
+                )
+        else:
+            logger.warning("Screen proxy check returned error - skipping: %s", screen_result.get('message'))
+
+    except HTTPException as e:
+        if e.status_code in [503, 504]:
+            raise
+        logger.warning("Screen proxy endpoint not available - skipping check")
+
+    return None
+
+async def cancel_tasks(tasks):
+    """Cancel whatever is still running and collect every outcome so nothing is left unretrieved"""
+    for task in tasks:
+        if not task.done():
+            task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def first_rejection(tasks) -> Optional[str]:
+    """Resolve check tasks in priority order.
+
+    The tasks are already running concurrently; a verdict only becomes final once
+    every higher-priority check has passed, so the first rejection in list order
+    wins exactly as it did when the checks ran one after another.
+    """
+    for task in tasks:
+        rejection = await task
+        if rejection:
+            return rejection
+    return None
+
 # ========== HELPER FUNCTIONS ==========
 
 def hash_password(password: str) -> str:
@@ -234,7 +609,7 @@ def generate_otp() -> str:
 def send_otp_email_via_brevo(to_email: str, otp: str, admin_name: str):
     """Send OTP email via Brevo API"""
     try:
-        print(f"[DEBUG] Preparing to send OTP via Brevo API to: {to_email}")
+        logger.debug("Preparing to send OTP via Brevo API to: %s", to_email)
         
         configuration = sib_api_v3_sdk.Configuration()
         configuration.api_key['api-key'] = BREVO_API_KEY
@@ -353,22 +728,254 @@ def send_otp_email_via_brevo(to_email: str, otp: str, admin_name: str):
             html_content=html_content
         )
         
-        print(f"[DEBUG] Sending email via Brevo API...")
+        logger.debug("Sending email via Brevo API...")
         api_response = api_instance.send_transac_email(send_smtp_email)
-        print(f"[DEBUG] Brevo API Response: {api_response}")
-        print(f"[DEBUG] OTP email sent successfully to {to_email}")
+        logger.debug("Brevo API Response: %s", api_response)
+        logger.debug("OTP email sent successfully to %s", to_email)
         
         return True
         
     except ApiException as e:
-        print(f"[ERROR] Brevo API Exception: {e}")
+        logger.error("Brevo API Exception: %s", e)
         return False
     except Exception as e:
-        print(f"[ERROR] Failed to send OTP email: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Failed to send OTP email: %s", e)
         return False
 
+# ========== DB HELPERS ==========
+# Synchronous Session work used by async endpoints - always call through run_db()
+
+def get_or_create_institute(db: Session, institute_name: str) -> Institute:
+    institute = db.query(Institute).filter(Institute.name == institute_name).first()
+    if not institute:
+        institute = Institute(name=institute_name)
+        db.add(institute)
+        db.commit()
+        db.refresh(institute)
+    return institute
+
+def save_and_refresh(db: Session, obj):
+    db.add(obj)
+    db.commit()
+    db.refresh(obj)
+    return obj
+
+def find_attendance(db: Session, student_id: int, day: date) -> Optional[Attendance]:
+    """Uses the unique (student_id, date) index"""
+    return db.query(Attendance).filter(
+        Attendance.student_id == student_id,
+        Attendance.date == day
+    ).first()
+
+def already_marked_response(student_name: str, roll_number: str, department: str, existing: Attendance) -> dict:
+    return {
+        "status": "warning",
+        "message": "Attendance already marked today!",
+        "data": {
+            "student": student_name,
+            "roll_number": roll_number,
+            "department": department,
+            "status": existing.status,
+            "match_confidence": None,
+            "dress_code_compliant": existing.dress_code_match,
+            "dress_code_details": None,
+            "time": existing.time.strftime("%H:%M:%S")
+        }
+    }
+
+async def open_institute_for_attendance(db: Session, institute_name: str) -> tuple:
+    """(institute, None) if attendance can be marked today, else (None, error response): unknown institute or holiday"""
+    # Cache hits (the common case) skip the database entirely
+    institute = institute_directory.get_cached(institute_name)
+    if institute is None:
+        institute = await run_db(institute_directory.lookup, db, institute_name)
+
+    if not institute:
+        logger.error("Institute '%s' not found!", institute_name)
+        return None, {
+            "status": "error",
+            "message": f"Institute '{institute_name}' not found!"
+        }
+
+    logger.debug("Institute found: ID=%s, Name='%s'", institute.id, institute.name)
+
+    today = date.today()
+    day_of_week = today.weekday()
+
+    logger.debug("Checking holiday for: %s (%s)", today, ['Mon','Tue','Wed','Thu','Fri','Sat','Sun'][day_of_week])
+
+    month_calendar = calendar_cache.get_cached(institute.id, today)
+    if month_calendar is None:
+        month_calendar = await run_db(calendar_cache.get, db, institute.id, today)
+    day_status = month_calendar.status(today)
+
+    if day_status.is_holiday:
+        logger.debug("Holiday: reason='%s', custom=%s", day_status.reason, day_status.is_custom)
+        if day_status.is_custom:
+            return None, {
+                "status": "error",
+                "message": f"Today is a holiday ({day_status.reason}). Attendance marking is disabled."
+            }
+        return None, {
+            "status": "error",
+            "message": f"Today is {day_status.reason}. Attendance marking is disabled."
+        }
+
+    return institute, None
+
+def existing_attendance(db: Session, student_ids: List[int], day: date) -> dict:
+    """{student_id: (time, status, dress_code_match)} for students already marked on `day` - one query"""
+    if not student_ids:
+        return {}
+    rows = db.query(
+        Attendance.student_id, Attendance.time, Attendance.status, Attendance.dress_code_match
+    ).filter(
+        Attendance.student_id.in_(student_ids),
+        Attendance.date == day
+    ).all()
+    return {row.student_id: row for row in rows}
+
+def bulk_mark_attendance(db: Session, student_ids: List[int], day: date, mark_time, status: str,
+                         dress_code_match: Optional[bool]) -> dict:
+    """Insert every row in ONE INSERT .. ON CONFLICT DO NOTHING; returns {student_id: attendance_id} of rows inserted"""
+    if not student_ids:
+        return {}
+    statement = pg_insert(Attendance).values([
+        {
+            "student_id": student_id,
+            "date": day,
+            "time": mark_time,
+            "status": status,
+            "face_match": True,
+            "dress_code_match": dress_code_match,
+            "created_at": datetime.utcnow()
+        }
+        for student_id in student_ids
+    ]).on_conflict_do_nothing(
+        index_elements=["student_id", "date"]
+    ).returning(Attendance.id, Attendance.student_id)
+
+    inserted = {row.student_id: row.id for row in db.execute(statement)}
+    db.commit()
+    return inserted
+
+def save_attendance_and_enqueue(db: Session, attendance: Attendance, kind: str, payload: dict) -> Attendance:
+    """Attendance row and its follow-up job in ONE transaction - the job exists iff the row does"""
+    db.add(attendance)
+    db.flush()
+    db.add(job_queue.new_job(kind, {**payload, "attendance_id": attendance.id}))
+    db.commit()
+    db.refresh(attendance)
+    return attendance
+
+def settle_dress_code(db: Session, attendance_id: int, status: str, dress_code_match: Optional[bool]):
+    """Store the background dress code verdict (None: could not be checked); returns the row for the
+    live feed (None if it was deleted)"""
+    updated = db.query(Attendance).filter(Attendance.id == attendance_id).update({
+        Attendance.status: status,
+        Attendance.dress_code_match: dress_code_match
+    }, synchronize_session=False)
+    db.commit()
+    if not updated:
+        return None
+    
+    return db.query(
+        Attendance.id, Student.name, Student.roll_number, Student.department, Attendance.time, Attendance.status
+    ).join(Student, Attendance.student_id == Student.id).filter(Attendance.id == attendance_id).first()
+
+# ========== LISTING HELPERS ==========
+
+MAX_PAGE_SIZE = 1000
+
+# Public field name -> column; "id" is always returned because it is the page cursor
+STUDENT_FIELDS = {
+    "id": Student.id,
+    "name": Student.name,
+    "roll_number": Student.roll_number,
+    "department": Student.department
+}
+
+ATTENDANCE_FIELDS = {
+    "id": Attendance.id,
+    "student_name": Student.name,
+    "roll_number": Student.roll_number,
+    "department": Student.department,
+    "time": Attendance.time,
+    "status": Attendance.status
+}
+
+def parse_fields(fields: Optional[str], allowed: dict) -> list:
+    """Turn ?fields=a,b into a column list (all fields when omitted)"""
+    if not fields:
+        return list(allowed)
+    
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(allowed)}"
+        )
+    
+    return ["id"] + [f for f in requested if f != "id"]
+
+def keyset_page(query, id_column, after_id: Optional[int], limit: Optional[int]):
+    """Rows with id > after_id in id order. Returns (rows, next_after_id); no limit means every row"""
+    if after_id is not None:
+        query = query.filter(id_column > after_id)
+    query = query.order_by(id_column)
+    
+    if limit is None:
+        return query.all(), None
+    
+    # One extra row tells us whether another page exists
+    rows = query.limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1][0]
+    return rows, None
+
+# ========== METRICS GAUGES ==========
+# Computed when /metrics is scraped
+
+def db_pool_usage() -> dict:
+    pool = engine.pool
+    return {
+        ("checked_out",): pool.checkedout(),
+        ("idle",): pool.checkedin(),
+        ("overflow",): max(pool.overflow(), 0),
+        ("size",): pool.size()
+    }
+
+def ml_pool_usage() -> dict:
+    # httpx keeps its connection pool on the (private) transport; report nothing if that ever moves
+    pool = getattr(getattr(ml_client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {
+        ("active",): len(connections) - idle,
+        ("idle",): idle,
+        ("max",): ML_POOL_MAX_CONNECTIONS
+    }
+
+def background_job_counts() -> dict:
+    db = SessionLocal()
+    try:
+        return {(status,): count for status, count in job_queue.counts(db).items()}
+    finally:
+        db.close()
+
+gauge("db_pool_connections", "SQLAlchemy pool connections by state", db_pool_usage, ("state",))
+gauge("db_threads_in_use", "Worker threads running DB work via run_db",
+      lambda: {(): get_db_limiter().borrowed_tokens})
+gauge("ml_pool_connections", "ML service HTTP connections by state", ml_pool_usage, ("state",))
+gauge("face_batcher_pending", "Face images waiting for a micro-batch", lambda: {(): face_batcher.pending})
+gauge("ml_circuit_breaker_open", "ML circuit breaker state (0 closed, 0.5 half open, 1 open)",
+      lambda: {(): {"closed": 0, "half_open": 0.5, "open": 1}[ml_resilience.breaker.state]})
+gauge("attendance_feed_subscribers", "Open live attendance streams", lambda: {(): attendance_feed.subscriber_count()})
+if DRESS_CODE_CHECK == "background":
+    gauge("background_jobs", "Background jobs waiting, running or failed", background_job_counts, ("status",))
+
 # ========== API ENDPOINTS ==========
 
 @app.get("/")
@@ -383,6 +990,32 @@ def read_root():
 def test(request: Request):
     return {"status": "success", "data": "API connected successfully!"}
 
+@app.get("/health/ml")
+def ml_health():
+    """ML service circuit breaker state and recent per-endpoint latencies (503 while the breaker is open)"""
+    snapshot = ml_resilience.snapshot()
+    breaker_state = snapshot["circuit_breaker"]["state"]
+    
+    return JSONResponse(
+        status_code=503 if breaker_state == "open" else 200,
+        content={
+            "status": "success" if breaker_state == "closed" else "degraded",
+            "data": {
+                "ml_service": ML_SERVICE_URL,
+                **snapshot,
+                "face_batching": {
+                    "batch_endpoint_supported": face_batch_supported,
+                    "pending": face_batcher.pending
+                }
+            }
+        }
+    )
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text format: request/stage/ML/DB latency histograms, ML error counters, pool gauges"""
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
 @app.post("/register-student")
 async def register_student(
     name: str = Form(...),
@@ -394,17 +1027,13 @@ async def register_student(
 ):
     """Register a new student"""
     try:
-        print(f"\n[DEBUG] === STUDENT REGISTRATION START ===")
-        print(f"[DEBUG] Name: {name}, Roll: {roll_number}")
+        logger.debug("Student registration: name=%s, roll=%s", name, roll_number)
 
-        contents = await photo.read()
+        image = await prepare_image(await photo.read())
 
         # ── FACE COVERED CHECK AT REGISTRATION ──────────────────────────────
         try:
-            image_base64 = base64.b64encode(contents).decode('utf-8')
-            face_covered_result = await call_ml_service("/check-face-covered", {
-                "image_base64": image_base64
-            })
+            face_covered_result = await call_ml_service("/check-face-covered", image.as_request())
             if face_covered_result.get("status") == "success":
                 if face_covered_result.get("is_covered", False):
                     return {
@@ -415,26 +1044,22 @@ async def register_student(
                         )
                     }
         except Exception:
-            print(f"[WARNING] Face covered check skipped during registration")
+            logger.warning("Face covered check skipped during registration")
 
-        institute = db.query(Institute).filter(Institute.name == institute_name).first()
-        if not institute:
-            institute = Institute(name=institute_name)
-            db.add(institute)
-            db.commit()
-            db.refresh(institute)
+        institute = await run_db(get_or_create_institute, db, institute_name)
 
-        existing = db.query(Student).filter(
+        existing = await run_db(lambda: db.query(Student).filter(
             Student.roll_number == roll_number,
             Student.institute_id == institute.id
-        ).first()
+        ).first())
         if existing:
             return {
                 "status": "error",
                 "message": f"Student with roll number {roll_number} already exists!"
             }
 
-        face_encoding = await extract_face_encoding(contents)
+        face_encoding = face_encoding_to_bytes(await extract_face_encoding(image))
+        logger.debug("Registration image: %s", image)
 
         new_student = Student(
             name=name,
@@ -444,11 +1069,22 @@ async def register_student(
             face_encoding=face_encoding
         )
 
-        db.add(new_student)
-        db.commit()
-        db.refresh(new_student)
+        # Read before the commit expires it, so no lazy reload runs on the event loop
+        institute_id = institute.id
+        try:
+            await run_db(save_and_refresh, db, new_student)
+        except IntegrityError:
+            # A concurrent registration got the unique (institute_id, roll_number) slot first
+            await run_db(db.rollback)
+            return {
+                "status": "error",
+                "message": f"Student with roll number {roll_number} already exists!"
+            }
 
-        print(f"[DEBUG] Student registered successfully!")
+        # Append in place so the student can check in immediately (off the loop: it may retrain the index)
+        await asyncio.to_thread(gallery_manager.add_student, institute_id, new_student.id, face_encoding)
+
+        logger.info("Student registered: roll=%s, institute=%s", roll_number, institute_id)
 
         return {
             "status": "success",
@@ -462,15 +1098,99 @@ async def register_student(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
-        print(f"[ERROR] Registration failed: {str(e)}")
+        await run_db(db.rollback)
+        logger.error("Registration failed: %s", e)
         return {
             "status": "error",
             "message": f"Registration failed: {str(e)}"
         }
 
+async def encode_enrollment_photo(data: bytes) -> bytes:
+    """Bulk enrollment's per-photo work: same checks as /register-student, packed encoding out"""
+    image = await prepare_image(data)
+    try:
+        covered, encoding = await asyncio.gather(check_face_covered(image), extract_face_encoding(image))
+    except HTTPException as e:
+        raise Exception(e.detail)
+    if covered:
+        raise Exception(covered)
+    return face_encoding_to_bytes(encoding)
+
+@app.post("/admin/students/bulk")
+async def bulk_enroll_students(
+    institute_name: str = Form(...),
+    photos: UploadFile = File(...),
+    manifest: Optional[UploadFile] = File(None),
+    db: Session = Depends(get_db)
+):
+    """Enroll many students from a ZIP of photos plus a CSV manifest (name, roll_number, department[, photo]).
+
+    Photos are matched by the optional photo column or by <roll_number>.<ext>; the
+    manifest may also be bundled in the ZIP. Returns a job id to poll at
+    /admin/students/bulk/{job_id} - enrollment runs in the background.
+    """
+    archive_file = tempfile.NamedTemporaryFile(suffix=".zip", delete=False)
+    archive_path = archive_file.name
+    try:
+        # The upload is closed once this request returns, so the job gets its own copy
+        await asyncio.to_thread(shutil.copyfileobj, photos.file, archive_file)
+        archive_file.close()
+
+        with zipfile.ZipFile(archive_path) as archive:
+            photo_index = index_photos(archive)
+            if manifest is not None:
+                manifest_text = (await manifest.read()).decode("utf-8-sig")
+            else:
+                member = find_manifest(archive)
+                if member is None:
+                    raise ValueError("No CSV manifest uploaded or found in the ZIP")
+                manifest_text = read_member(archive, member).decode("utf-8-sig")
+
+        rows, rejected = parse_manifest(manifest_text, photo_index)
+        if not rows:
+            raise ValueError("No enrollable students in the manifest")
+
+        institute = await run_db(get_or_create_institute, db, institute_name)
+        job = EnrollmentJob(institute.id, len(rows), rejected)
+    except (ValueError, zipfile.BadZipFile, UnicodeDecodeError) as e:
+        archive_file.close()
+        os.unlink(archive_path)
+        logger.error("Bulk enrollment rejected: %s", e)
+        return {
+            "status": "error",
+            "message": f"Bulk enrollment failed: {str(e)}"
+        }
+    except BaseException:
+        archive_file.close()
+        os.unlink(archive_path)
+        raise
+
+    enrollment_jobs.add(job)
+    job.task = asyncio.create_task(
+        run_enrollment(job, archive_path, rows, encode_enrollment_photo, gallery_manager.add_student)
+    )
+    logger.info("Bulk enrollment %s: %s students queued, %s rejected", job.id, len(rows), len(rejected))
+
+    return {
+        "status": "success",
+        "message": f"Enrolling {len(rows)} students in the background",
+        "data": job.snapshot()
+    }
+
+@app.get("/admin/students/bulk/{job_id}")
+def get_bulk_enrollment(job_id: str):
+    """Poll a bulk enrollment job"""
+    job = enrollment_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Enrollment job not found")
+    
+    return {
+        "status": "success",
+        "data": job.snapshot()
+    }
+
 @app.post("/admin/register")
-async def register_admin(
+def register_admin(
     name: str = Form(...),
     email: str = Form(...),
     password: str = Form(...),
@@ -486,12 +1206,7 @@ async def register_admin(
                 "message": "Admin with this email already exists!"
             }
         
-        institute = db.query(Institute).filter(Institute.name == institute_name).first()
-        if not institute:
-            institute = Institute(name=institute_name)
-            db.add(institute)
-            db.commit()
-            db.refresh(institute)
+        institute = get_or_create_institute(db, institute_name)
         
         new_admin = Admin(
             name=name,
@@ -515,7 +1230,7 @@ async def register_admin(
         }
 
 @app.post("/admin/login")
-async def admin_login(
+def admin_login(
     email: str = Form(...),
     password: str = Form(...),
     db: Session = Depends(get_db)
@@ -546,25 +1261,24 @@ async def admin_login(
 # ========== OTP-BASED PASSWORD RESET ==========
 
 @app.post("/admin/send-otp")
-async def send_otp(
+def send_otp(
     email: str = Form(...),
     db: Session = Depends(get_db)
 ):
     """Send OTP to admin email via Brevo API"""
     try:
-        print(f"\n[DEBUG] === SEND OTP REQUEST ===")
-        print(f"[DEBUG] Email: {email}")
+        logger.debug("OTP requested for %s", email)
         
         admin = db.query(Admin).filter(Admin.email == email).first()
         
         if not admin:
-            print(f"[DEBUG] Email not found (returning generic message)")
+            logger.debug("Email not found (returning generic message)")
             return {
                 "status": "success",
                 "message": "If an account exists with this email, you will receive an OTP shortly."
             }
         
-        print(f"[DEBUG] Admin found: {admin.name}")
+        logger.debug("Admin found: %s", admin.name)
         
         otp = generate_otp()
         expires_at = datetime.utcnow() + timedelta(minutes=OTP_EXPIRE_MINUTES)
@@ -582,7 +1296,8 @@ async def send_otp(
         db.add(db_token)
         db.commit()
         
-        print(f"[DEBUG] OTP: {otp}, expires: {expires_at}")
+        # Never log the OTP itself - anyone with log access could reset the password
+        logger.debug("OTP issued for admin %s, expires: %s", admin.id, expires_at)
         
         email_sent = send_otp_email_via_brevo(email, otp, admin.name)
         
@@ -592,7 +1307,7 @@ async def send_otp(
                 "message": "Failed to send OTP. Please try again later."
             }
         
-        print(f"[DEBUG] === OTP SENT ===\n")
+        logger.info("Password reset OTP sent to admin %s", admin.id)
         
         return {
             "status": "success",
@@ -601,22 +1316,21 @@ async def send_otp(
         
     except Exception as e:
         db.rollback()
-        print(f"[ERROR] Send OTP failed: {str(e)}")
+        logger.error("Send OTP failed: %s", e)
         return {
             "status": "error",
             "message": "An error occurred. Please try again."
         }
 
 @app.post("/admin/verify-otp")
-async def verify_otp(
+def verify_otp(
     email: str = Form(...),
     otp: str = Form(...),
     db: Session = Depends(get_db)
 ):
     """Verify OTP"""
     try:
-        print(f"\n[DEBUG] === VERIFY OTP ===")
-        print(f"[DEBUG] Email: {email}, OTP: {otp}")
+        logger.debug("OTP verification for %s", email)
         
         admin = db.query(Admin).filter(Admin.email == email).first()
         
@@ -644,7 +1358,7 @@ async def verify_otp(
                 "message": "OTP has expired! Please request a new one."
             }
         
-        print(f"[DEBUG] OTP verified")
+        logger.debug("OTP verified")
         
         return {
             "status": "success",
@@ -656,14 +1370,14 @@ async def verify_otp(
         }
         
     except Exception as e:
-        print(f"[ERROR] OTP verification failed: {str(e)}")
+        logger.error("OTP verification failed: %s", e)
         return {
             "status": "error",
             "message": "An error occurred."
         }
 
 @app.post("/admin/reset-password-with-otp")
-async def reset_password_with_otp(
+def reset_password_with_otp(
     email: str = Form(...),
     otp: str = Form(...),
     new_password: str = Form(...),
@@ -671,7 +1385,7 @@ async def reset_password_with_otp(
 ):
     """Reset password using OTP"""
     try:
-        print(f"\n[DEBUG] === RESET PASSWORD ===")
+        logger.debug("Password reset for %s", email)
         
         admin = db.query(Admin).filter(Admin.email == email).first()
         
@@ -710,7 +1424,7 @@ async def reset_password_with_otp(
         
         db.commit()
         
-        print(f"[DEBUG] Password reset successful")
+        logger.info("Password reset for admin %s", admin.id)
         
         return {
             "status": "success",
@@ -719,7 +1433,7 @@ async def reset_password_with_otp(
         
     except Exception as e:
         db.rollback()
-        print(f"[ERROR] Password reset failed: {str(e)}")
+        logger.error("Password reset failed: %s", e)
         return {
             "status": "error",
             "message": "An error occurred."
@@ -728,7 +1442,7 @@ async def reset_password_with_otp(
 # ========== OTHER ENDPOINTS ==========
 
 @app.get("/check-holiday/{institute_name}")
-async def check_if_holiday(
+def check_if_holiday(
     institute_name: str,
     db: Session = Depends(get_db)
 ):
@@ -737,17 +1451,13 @@ async def check_if_holiday(
         today = date.today()
         day_of_week = today.weekday()
         
-        print(f"\n[DEBUG] === CHECK HOLIDAY ===")
-        print(f"[DEBUG] Institute name: '{institute_name}'")
-        print(f"[DEBUG] Today: {today} ({['Mon','Tue','Wed','Thu','Fri','Sat','Sun'][day_of_week]})")
+        logger.debug("Holiday check for '%s' on %s (%s)", institute_name, today, ['Mon','Tue','Wed','Thu','Fri','Sat','Sun'][day_of_week])
         
-        # Find institute (case-insensitive)
-        institute = db.query(Institute).filter(
-            Institute.name.ilike(institute_name.strip())
-        ).first()
+        # Find institute (case-insensitive, cached)
+        institute = institute_directory.lookup(db, institute_name)
         
         if not institute:
-            print(f"[DEBUG] Institute not found - checking default weekend")
+            logger.debug("Institute not found - checking default weekend")
             is_weekend_default = day_of_week in [5, 6]
             return {
                 "status": "success",
@@ -757,76 +1467,22 @@ async def check_if_holiday(
                 "is_custom": False
             }
         
-        print(f"[DEBUG] Institute found: ID={institute.id}, Name='{institute.name}'")
+        logger.debug("Institute found: ID=%s, Name='%s'", institute.id, institute.name)
         
-        # Check for custom holiday setting
-        custom_holiday = db.query(Holiday).filter(
-            Holiday.institute_id == institute.id,
-            Holiday.date == today
-        ).first()
+        # Priority: admin override, then default weekend, then regular working day
+        day_status = calendar_cache.get(db, institute.id, today).status(today)
+        logger.debug("→ is_holiday=%s, reason='%s', custom=%s", day_status.is_holiday, day_status.reason, day_status.is_custom)
         
-        # PRIORITY 1: Custom override exists - ALWAYS use this first
-        if custom_holiday:
-            print(f"[DEBUG] ✅ Custom override found: is_holiday={custom_holiday.is_holiday}, reason='{custom_holiday.reason}'")
-            
-            # If admin marked it as WORKING DAY (is_holiday=False)
-            if not custom_holiday.is_holiday:
-                # Check if it's a weekend being overridden
-                if day_of_week in [5, 6]:
-                    day_name = "Saturday" if day_of_week == 5 else "Sunday"
-                    reason = custom_holiday.reason or f"Working Day (Weekend Override: {day_name})"
-                    print(f"[DEBUG] → Weekend overridden as working day")
-                else:
-                    reason = custom_holiday.reason or "Working Day"
-                    print(f"[DEBUG] → Custom working day")
-                
-                return {
-                    "status": "success",
-                    "is_holiday": False,
-                    "reason": reason,
-                    "date": today.isoformat(),
-                    "is_custom": True
-                }
-            
-            # If admin marked it as HOLIDAY (is_holiday=True)
-            else:
-                reason = custom_holiday.reason or "Holiday"
-                print(f"[DEBUG] → Custom holiday: {reason}")
-                return {
-                    "status": "success",
-                    "is_holiday": True,
-                    "reason": reason,
-                    "date": today.isoformat(),
-                    "is_custom": True
-                }
-        
-        # PRIORITY 2: No custom override - check default weekend
-        print(f"[DEBUG] No custom override found, checking default calendar")
-        if day_of_week in [5, 6]:
-            day_name = "Saturday" if day_of_week == 5 else "Sunday"
-            print(f"[DEBUG] → Default weekend: {day_name}")
-            return {
-                "status": "success",
-                "is_holiday": True,
-                "reason": day_name,
-                "date": today.isoformat(),
-                "is_custom": False
-            }
-        
-        # PRIORITY 3: Regular working day
-        print(f"[DEBUG] → Regular working day")
         return {
             "status": "success",
-            "is_holiday": False,
-            "reason": "Working day",
+            "is_holiday": day_status.is_holiday,
+            "reason": day_status.reason,
             "date": today.isoformat(),
-            "is_custom": False
+            "is_custom": day_status.is_custom
         }
         
     except Exception as e:
-        print(f"[ERROR] Check holiday failed: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Check holiday failed: %s", e)
         return {
             "status": "error",
             "message": str(e),
@@ -834,54 +1490,151 @@ async def check_if_holiday(
         }
 
 @app.get("/admin/students/{institute_id}")
-async def get_students(
+def get_students(
     institute_id: int,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    department: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    """Get all students"""
-    students = db.query(Student).filter(Student.institute_id == institute_id).all()
+    """Get students - keyset pages by id (after_id + limit), optional fields= projection and department filter"""
+    selected = parse_fields(fields, STUDENT_FIELDS)
+    
+    query = db.query(*[STUDENT_FIELDS[f] for f in selected]).filter(Student.institute_id == institute_id)
+    if department:
+        query = query.filter(Student.department == department)
+    
+    rows, next_after_id = keyset_page(query, Student.id, after_id, limit)
     
     return {
         "status": "success",
-        "data": [
-            {
-                "id": s.id,
-                "name": s.name,
-                "roll_number": s.roll_number,
-                "department": s.department
-            }
-            for s in students
-        ]
+        "data": [dict(zip(selected, row)) for row in rows],
+        "next_after_id": next_after_id
+    }
+
+@app.delete("/admin/student/{id}")
+def delete_student(
+    id: int,
+    db: Session = Depends(get_db)
+):
+    """Delete student"""
+    student = db.query(Student).filter(Student.id == id).first()
+    
+    if not student:
+        return {
+            "status": "error",
+            "message": "Student not found!"
+        }
+    
+    institute_id = student.institute_id
+    db.delete(student)
+    db.commit()
+    
+    gallery_manager.remove_student(institute_id, id)
+    
+    return {
+        "status": "success",
+        "message": "Student deleted successfully!"
     }
 
 @app.get("/admin/attendance/{institute_id}/today")
-async def get_today_attendance(
+def get_today_attendance(
     institute_id: int,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    department: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    """Get today's attendance"""
+    """Get today's attendance - one joined query, same paging/projection/filter options as the student list"""
     today = date.today()
+    selected = parse_fields(fields, ATTENDANCE_FIELDS)
     
-    attendance_records = db.query(Attendance).join(Student).filter(
+    query = db.query(*[ATTENDANCE_FIELDS[f] for f in selected]).join(
+        Student, Attendance.student_id == Student.id
+    ).filter(
         Student.institute_id == institute_id,
         Attendance.date == today
-    ).all()
+    )
+    if department:
+        query = query.filter(Student.department == department)
+    
+    rows, next_after_id = keyset_page(query, Attendance.id, after_id, limit)
+    
+    data = []
+    for row in rows:
+        record = dict(zip(selected, row))
+        if "time" in record:
+            record["time"] = record["time"].strftime("%H:%M:%S")
+        data.append(record)
     
     return {
         "status": "success",
-        "data": [
-            {
-                "id": a.id,
-                "student_name": a.student.name,
-                "roll_number": a.student.roll_number,
-                "department": a.student.department,
-                "time": a.time.strftime("%H:%M:%S"),
-                "status": a.status
-            }
-            for a in attendance_records
-        ]
+        "data": data,
+        "next_after_id": next_after_id
     }
 
+@app.get("/admin/attendance/{institute_id}/stream")
+async def stream_attendance(
+    institute_id: int,
+    request: Request,
+    last_event_id: Optional[int] = None
+):
+    """Live feed of today's check-ins as Server-Sent Events.
+
+    Event ids are attendance ids. A reconnecting EventSource sends Last-Event-ID
+    (or pass ?last_event_id=) and first gets every row it missed, then live ones.
+    Rows commit in any order, so ids are not increasing and the replay may repeat
+    a few rows the client already has - key rows by id.
+    Later changes to a row (a background dress code verdict) come as
+    "attendance_update" events without an id.
+    """
+    header_id = request.headers.get("last-event-id")
+    if header_id and header_id.isdigit():
+        last_event_id = int(header_id)
+    
+    async def events():
+        # Subscribe before replaying so nothing committed in between is lost
+        queue = attendance_feed.subscribe(institute_id)
+        # Rows sent by the replay that may also be waiting in the queue
+        replayed = set()
+        try:
+            yield "retry: 3000\n\n"
+            
+            if last_event_id is not None:
+                db = SessionLocal()
+                try:
+                    missed = await run_db(load_events_since, db, institute_id, last_event_id)
+                finally:
+                    await run_db(db.close)
+                for event in missed:
+                    yield format_sse(event)
+                    replayed.add(event["id"])
+            
+            while not await request.is_disconnected():
+                event = await attendance_feed.next_event(queue)
+                if event is None:
+                    logger.debug("Attendance stream for institute %s fell behind, closing", institute_id)
+                    break
+                if event == "heartbeat":
+                    yield ": keep-alive\n\n"
+                    continue
+                if event["event"] != "attendance":
+                    yield format_sse(event)
+                    continue
+                if event["id"] in replayed:
+                    continue
+                yield format_sse(event)
+        finally:
+            attendance_feed.unsubscribe(institute_id, queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/admin/dress-code/upload")
 async def upload_dress_code(
     institute_id: int = Form(...),
@@ -891,31 +1644,41 @@ async def upload_dress_code(
 ):
     """Upload dress code"""
     try:
-        contents = await photo.read()
-        image_base64 = base64.b64encode(contents).decode('utf-8')
+        original = ImagePayload(await photo.read())
+        image = await prepare_image(original.data)
+        
+        # Extract the reference features once here instead of on every check-in
+        try:
+            clothing_features = json.dumps(await extract_clothing_features(image))
+        except Exception as e:
+            logger.warning("Clothing features not extracted at upload - will retry on first check-in: %s", e)
+            clothing_features = None
         
         new_dress_code = DressCode(
             institute_id=institute_id,
             dress_type=dress_type,
-            image_data=image_base64
+            # The admin dashboard shows the upload as-is; only the ML service gets the downscaled copy
+            image_data=original.base64,
+            clothing_features=clothing_features
         )
         
-        db.add(new_dress_code)
-        db.commit()
+        await run_db(save_and_refresh, db, new_dress_code)
+        
+        dress_code_cache.invalidate(institute_id)
         
         return {
             "status": "success",
             "message": "Dress code uploaded successfully!"
         }
     except Exception as e:
-        db.rollback()
+        await run_db(db.rollback)
         return {
             "status": "error",
             "message": f"Upload failed: {str(e)}"
         }
 
 @app.get("/admin/dress-codes/{institute_id}")
-async def get_dress_codes(
+def get_dress_codes(
     institute_id: int,
     db: Session = Depends(get_db)
 ):
@@ -935,7 +1698,7 @@ async def get_dress_codes(
     }
 
 @app.delete("/admin/dress-code/{id}")
-async def delete_dress_code(
+def delete_dress_code(
     id: int,
     db: Session = Depends(get_db)
 ):
@@ -948,16 +1711,19 @@ async def delete_dress_code(
             "message": "Dress code not found!"
         }
     
+    institute_id = dress_code.institute_id
     db.delete(dress_code)
     db.commit()
     
+    dress_code_cache.invalidate(institute_id)
+    
     return {
         "status": "success",
         "message": "Dress code deleted successfully!"
     }
 
 @app.get("/holidays/{institute_id}")
-async def get_holidays(
+def get_holidays(
     institute_id: int,
     db: Session = Depends(get_db)
 ):
@@ -984,7 +1750,7 @@ async def get_holidays(
         }
 
 @app.post("/admin/toggle-holiday")
-async def toggle_holiday(
+def toggle_holiday(
     institute_id: int = Form(...),
     date: str = Form(...),
     is_holiday: str = Form(...),  # ← CHANGED TO STRING!
@@ -993,8 +1759,7 @@ async def toggle_holiday(
 ):
     """Toggle holiday - FIXED VERSION"""
     try:
-        print(f"\n[DEBUG] === TOGGLE HOLIDAY ===")
-        print(f"[DEBUG] Received: institute_id={institute_id}, date={date}, is_holiday={is_holiday} (type: {type(is_holiday)}), reason={reason}")
+        logger.debug("Toggle holiday: institute_id=%s, date=%s, is_holiday=%s (type: %s), reason=%s", institute_id, date, is_holiday, type(is_holiday), reason)
         
         from datetime import datetime as dt
         date_obj = dt.strptime(date, "%Y-%m-%d").date()
@@ -1002,7 +1767,7 @@ async def toggle_holiday(
         # Convert string to boolean properly
         is_holiday_bool = is_holiday.lower() in ['true', '1', 'yes']
         
-        print(f"[DEBUG] Converted is_holiday to: {is_holiday_bool} (type: {type(is_holiday_bool)})")
+        logger.debug("Converted is_holiday to: %s (type: %s)", is_holiday_bool, type(is_holiday_bool))
         
         existing = db.query(Holiday).filter(
             Holiday.institute_id == institute_id,
@@ -1010,13 +1775,13 @@ async def toggle_holiday(
         ).first()
         
         if existing:
-            print(f"[DEBUG] Updating existing record ID={existing.id}")
+            logger.debug("Updating existing record ID=%s", existing.id)
             existing.is_holiday = is_holiday_bool
             if reason:
                 existing.reason = reason
             message = f"Updated {date}"
         else:
-            print(f"[DEBUG] Creating new record")
+            logger.debug("Creating new record")
             new_holiday = Holiday(
                 institute_id=institute_id,
                 date=date_obj,
@@ -1028,13 +1793,15 @@ async def toggle_holiday(
         
         db.commit()
         
+        calendar_cache.invalidate(institute_id, date_obj)
+        
         # Verify it was saved
         verify = db.query(Holiday).filter(
             Holiday.institute_id == institute_id,
             Holiday.date == date_obj
         ).first()
         
-        print(f"[DEBUG] ✅ Saved to database: ID={verify.id}, is_holiday={verify.is_holiday}, reason={verify.reason}")
+        logger.debug("✅ Saved to database: ID=%s, is_holiday=%s, reason=%s", verify.id, verify.is_holiday, verify.reason)
         
         return {
             "status": "success",
@@ -1043,9 +1810,7 @@ async def toggle_holiday(
         
     except Exception as e:
         db.rollback()
-        print(f"[ERROR] Toggle holiday failed: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Toggle holiday failed: %s", e)
         return {
             "status": "error",
             "message": str(e)
@@ -1059,162 +1824,71 @@ async def mark_attendance(
 ):
     """Mark attendance"""
     try:
-        print(f"\n[DEBUG] === ATTENDANCE MARKING ===")
-        print(f"[DEBUG] Institute name: '{institute_name}'")
-
-        contents = await photo.read()
-
-        institute = db.query(Institute).filter(
-            Institute.name.ilike(institute_name.strip())
-        ).first()
+        logger.debug("Attendance marking for institute '%s'", institute_name)
 
-        if not institute:
-            print(f"[ERROR] Institute '{institute_name}' not found!")
-            return {
-                "status": "error",
-                "message": f"Institute '{institute_name}' not found!"
-            }
+        image = await prepare_image(await photo.read())
 
-        print(f"[DEBUG] Institute found: ID={institute.id}, Name='{institute.name}'")
+        with timed("institute_and_holiday"):
+            institute, closed = await open_institute_for_attendance(db, institute_name)
+        if closed:
+            return closed
 
         today = date.today()
-        day_of_week = today.weekday()
-
-        print(f"[DEBUG] Checking holiday for: {today} ({['Mon','Tue','Wed','Thu','Fri','Sat','Sun'][day_of_week]})")
-
-        custom_holiday = db.query(Holiday).filter(
-            Holiday.institute_id == institute.id,
-            Holiday.date == today
-        ).first()
 
-        if custom_holiday:
-            print(f"[DEBUG] Custom override found: is_holiday={custom_holiday.is_holiday}")
-            if custom_holiday.is_holiday:
-                reason = custom_holiday.reason or "Holiday"
-                return {
-                    "status": "error",
-                    "message": f"Today is a holiday ({reason}). Attendance marking is disabled."
-                }
-        else:
-            if day_of_week in [5, 6]:
-                day_name = "Saturday" if day_of_week == 5 else "Sunday"
-                return {
-                    "status": "error",
-                    "message": f"Today is {day_name}. Attendance marking is disabled."
-                }
-
-        print(f"[DEBUG] Holiday check passed - running liveness detection")
-
-        # ── LIVENESS DETECTION ──────────────────────────────────────────────
-        try:
-            image_base64 = base64.b64encode(contents).decode('utf-8')
-            liveness_result = await call_ml_service("/check-liveness", {
-                "image_base64": image_base64
-            })
-
-            if liveness_result.get("status") == "success":
-                is_live = liveness_result.get("is_live", True)
-                liveness_score = liveness_result.get("score", 1.0)
-                print(f"[DEBUG] Liveness: is_live={is_live}, score={liveness_score:.2f}")
-
-                if not is_live:
-                    return {
-                        "status": "error",
-                        "message": (
-                            "Liveness check failed! A photo or screen was detected. "
-                            "Please use a live face for attendance."
-                        )
-                    }
-            else:
-                print(f"[WARNING] Liveness check returned error - skipping: {liveness_result.get('message')}")
-
-        except HTTPException as e:
-            if e.status_code in [503, 504]:
-                raise
-            print(f"[WARNING] Liveness endpoint not available - skipping liveness check")
-
-        # ── FACE COVERED / MASKED DETECTION ─────────────────────────────────
-        # Call ML service to check if face is covered (mask, scarf, hands, etc.)
-        try:
-            image_base64 = base64.b64encode(contents).decode('utf-8')
-            face_covered_result = await call_ml_service("/check-face-covered", {
-                "image_base64": image_base64
-            })
-
-            if face_covered_result.get("status") == "success":
-                is_covered = face_covered_result.get("is_covered", False)
-                print(f"[DEBUG] Face covered check: is_covered={is_covered}")
-
-                if is_covered:
-                    return {
-                        "status": "error",
-                        "message": (
-                            "Face is covered or masked! Please remove any mask, "
-                            "scarf, or obstruction and try again."
-                        )
-                    }
-            else:
-                print(f"[WARNING] Face covered check returned error - skipping: {face_covered_result.get('message')}")
-
-        except HTTPException as e:
-            if e.status_code in [503, 504]:
-                raise
-            print(f"[WARNING] Face covered endpoint not available - skipping check")
+        logger.debug("Holiday check passed - running pre-match checks")
+
+        # ── LIVENESS / FACE COVERED / SCREEN PROXY + FACE RECOGNITION ──────
+        # The three checks and the face extraction are independent, so they run
+        # concurrently: latency is the slowest call rather than the sum of all four.
+        # One payload shared by every ML call below - base64-encoded by whichever call needs it first
+        logger.debug("Attendance image: %s", image)
+        check_tasks = [
+            asyncio.create_task(check_liveness(image)),
+            asyncio.create_task(check_face_covered(image)),
+            asyncio.create_task(check_screen_proxy(image)),
+        ]
+        face_task = asyncio.create_task(extract_face_encoding(image))
+        all_tasks = check_tasks + [face_task]
 
-        # ── MOBILE PROXY / SCREEN DETECTION ─────────────────────────────────
-        # Detects if someone is holding up a phone/screen showing another person's face.
-        # Works alongside liveness but specifically targets screen artifacts
-        # (moire patterns, screen glare, pixel grid).
         try:
-            image_base64 = base64.b64encode(contents).decode('utf-8')
-            screen_result = await call_ml_service("/check-screen-proxy", {
-                "image_base64": image_base64
-            })
-
-            if screen_result.get("status") == "success":
-                is_screen = screen_result.get("is_screen", False)
-                confidence = screen_result.get("confidence", 0.0)
-                print(f"[DEBUG] Screen proxy check: is_screen={is_screen}, confidence={confidence:.2f}")
-
-                if is_screen:
-                    return {
-                        "status": "error",
-                        "message": (
-                            "Mobile proxy attendance detected! A screen or device "
-                            "was detected instead of a live face. "
-                            "Please appear in person for attendance."
-                        )
-                    }
-            else:
-                print(f"[WARNING] Screen proxy check returned error - skipping: {screen_result.get('message')}")
-
-        except HTTPException as e:
-            if e.status_code in [503, 504]:
-                raise
-            print(f"[WARNING] Screen proxy endpoint not available - skipping check")
+            with timed("pre_match_checks"):
+                rejection = await first_rejection(check_tasks)
+        except BaseException:
+            await cancel_tasks(all_tasks)
+            raise
+
+        if rejection:
+            await cancel_tasks(all_tasks)
+            return {
+                "status": "error",
+                "message": rejection
+            }
 
-        # ── FACE RECOGNITION ────────────────────────────────────────────────
-        print(f"[DEBUG] Running face recognition")
+        logger.debug("Pre-match checks passed - running face recognition")
         try:
-            current_encoding = await extract_face_encoding(contents)
+            # Only the part of the extraction that outlasts the checks
+            with timed("face_extraction"):
+                current_encoding = await face_task
         except Exception as face_error:
             error_msg = str(face_error)
-            print(f"[ERROR] Face extraction failed: {error_msg}")
+            logger.error("Face extraction failed: %s", error_msg)
             return {
                 "status": "error",
                 "message": error_msg
             }
 
-        students = db.query(Student).filter(Student.institute_id == institute.id).all()
+        # One vectorized search over the institute's in-memory gallery
+        # instead of a /compare-faces round-trip per registered student
+        with timed("gallery_match"):
+            gallery = await run_db(gallery_manager.get, db, institute.id)
+            matched_student_id, best_match_distance = gallery.best_match(
+                current_encoding, threshold=FACE_MATCH_THRESHOLD
+            )
+        logger.debug("Gallery search over %s students: id=%s, distance=%.4f", len(gallery), matched_student_id, best_match_distance)
 
         matched_student = None
-        best_match_distance = 999
-
-        for student in students:
-            is_match, distance = await compare_faces(student.face_encoding, current_encoding)
-            if is_match and distance < best_match_distance:
-                matched_student = student
-                best_match_distance = distance
+        if matched_student_id is not None:
+            matched_student = await run_db(lambda: db.query(Student).filter(Student.id == matched_student_id).first())
 
         if not matched_student:
             return {
@@ -1222,55 +1896,75 @@ async def mark_attendance(
                 "message": "Face not recognized! Please register first."
             }
 
+        # Read now - later commits expire the instance and a reload would run on the event loop
+        student_id = matched_student.id
+        student_name = matched_student.name
+        student_roll_number = matched_student.roll_number
+        student_department = matched_student.department
+
         # ── ALREADY MARKED CHECK ─────────────────────────────────────────────
-        existing = db.query(Attendance).filter(
-            Attendance.student_id == matched_student.id,
-            Attendance.date == today
-        ).first()
+        with timed("already_marked_check"):
+            existing = await run_db(find_attendance, db, student_id, today)
 
         if existing:
-            return {
-                "status": "warning",
-                "message": "Attendance already marked today!",
-                "data": {
-                    "student": matched_student.name,
-                    "roll_number": matched_student.roll_number,
-                    "department": matched_student.department,
-                    "status": existing.status,
-                    "match_confidence": None,
-                    "dress_code_compliant": existing.dress_code_match,
-                    "dress_code_details": None,
-                    "time": existing.time.strftime("%H:%M:%S")
-                }
-            }
+            return already_marked_response(student_name, student_roll_number, student_department, existing)
 
         # ── DRESS CODE CHECK ─────────────────────────────────────────────────
-        dress_codes = db.query(DressCode).filter(DressCode.institute_id == institute.id).all()
-        dress_code_compliant, dress_code_details = await verify_dress_code(contents, dress_codes, db)
-
-        status = "Present" if dress_code_compliant else "Present - Dress Code Violation"
+        # In background mode the row is saved as provisional "Present" right away and
+        # a queued job fills in the dress code verdict (dress_code_match is NULL until then,
+        # and stays NULL with status DRESS_CODE_UNCHECKED_STATUS if the job gives up)
+        with timed("dress_code"):
+            check_in_background = (
+                DRESS_CODE_CHECK == "background"
+                and await run_db(dress_code_cache.count, db, institute.id) > 0
+            )
+            if check_in_background:
+                dress_code_compliant = None
+                dress_code_details = {"message": "Dress code check in progress", "pending": True}
+                status = "Present"
+            else:
+                dress_code_compliant, dress_code_details = await verify_dress_code(image, institute.id, db)
+                status = "Present" if dress_code_compliant else "Present - Dress Code Violation"
 
         new_attendance = Attendance(
-            student_id=matched_student.id,
+            student_id=student_id,
             date=today,
             time=datetime.now().time(),
             status=status,
             face_match=True,
-            dress_code_match=dress_code_compliant
+            # A plain None would be replaced by the column default (True) on INSERT
+            dress_code_match=null() if dress_code_compliant is None else dress_code_compliant
         )
 
-        db.add(new_attendance)
-        db.commit()
+        try:
+            with timed("db_write"):
+                if check_in_background:
+                    await run_db(save_attendance_and_enqueue, db, new_attendance, DRESS_CODE_JOB, {
+                        "institute_id": institute.id,
+                        "image_base64": image.base64
+                    })
+                    job_queue.notify()
+                else:
+                    await run_db(save_and_refresh, db, new_attendance)
+        except IntegrityError:
+            # A concurrent check-in for the same student got the unique (student_id, date) slot first
+            await run_db(db.rollback)
+            existing = await run_db(find_attendance, db, student_id, today)
+            return already_marked_response(student_name, student_roll_number, student_department, existing)
+
+        logger.info("Attendance marked: student=%s, institute=%s, status=%s", student_id, institute.id, status)
 
-        print(f"[DEBUG] Attendance marked: {status}")
+        attendance_feed.publish(institute.id, attendance_event(
+            new_attendance.id, student_name, student_roll_number, student_department, new_attendance.time, status
+        ))
 
         return {
             "status": "success",
-            "message": f"Attendance marked for {matched_student.name}!",
+            "message": f"Attendance marked for {student_name}!",
             "data": {
-                "student": matched_student.name,
-                "roll_number": matched_student.roll_number,
-                "department": matched_student.department,
+                "student": student_name,
+                "roll_number": student_roll_number,
+                "department": student_department,
                 "match_confidence": f"{(1 - best_match_distance) * 100:.2f}%",
                 "status": status,
                 "dress_code_compliant": dress_code_compliant,
@@ -1281,137 +1975,203 @@ async def mark_attendance(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
-        print(f"[ERROR] Attendance failed: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        await run_db(db.rollback)
+        logger.exception("Attendance failed: %s", e)
         return {
             "status": "error",
             "message": f"Attendance marking failed: {str(e)}"
         }
 
+@app.post("/mark-attendance/group")
+async def mark_group_attendance(
+    institute_name: str = Form(...),
+    photo: UploadFile = File(...),
+    db: Session = Depends(get_db)
+):
+    """Mark attendance for every recognized face in one classroom photo.
+
+    All faces are matched against the gallery in one matrix operation and the
+    new rows go in with a single INSERT. Liveness/screen checks and the dress
+    code check are per-person selfie checks, so they are not run here: rows are
+    stored with dress_code_match = NULL (not checked).
+    """
+    try:
+        logger.debug("Group attendance marking for institute '%s'", institute_name)
+
+        image = await prepare_image(await photo.read(), max_side=IMAGE_GROUP_MAX_SIDE)
+
+        with timed("institute_and_holiday"):
+            institute, closed = await open_institute_for_attendance(db, institute_name)
+        if closed:
+            return closed
+
+        today = date.today()
+
+        try:
+            with timed("group_face_extraction"):
+                faces = await extract_all_face_encodings(image)
+        except HTTPException:
+            raise
+        except Exception as face_error:
+            logger.error("Group face extraction failed: %s", face_error)
+            return {
+                "status": "error",
+                "message": str(face_error)
+            }
+
+        if not faces:
+            return {
+                "status": "error",
+                "message": "No faces detected in the photo!"
+            }
+
+        with timed("group_gallery_match"):
+            gallery = await run_db(gallery_manager.get, db, institute.id)
+            matches = gallery.match_many([face["face_encoding"] for face in faces], threshold=FACE_MATCH_THRESHOLD)
+        matched_ids = [student_id for student_id, _ in matches if student_id is not None]
+        logger.debug("Group photo: %s faces, %s recognized among %s students", len(faces), len(matched_ids), len(gallery))
+
+        students = {}
+        already_marked = {}
+        inserted = {}
+        mark_time = datetime.now().time()
+        if matched_ids:
+            with timed("group_db_write"):
+                students = {
+                    row.id: row for row in await run_db(lambda: db.query(
+                        Student.id, Student.name, Student.roll_number, Student.department
+                    ).filter(Student.id.in_(matched_ids)).all())
+                }
+                already_marked = await run_db(existing_attendance, db, matched_ids, today)
+                to_insert = [student_id for student_id in matched_ids if student_id not in already_marked]
+                inserted = await run_db(
+                    bulk_mark_attendance, db, to_insert, today, mark_time, GROUP_ATTENDANCE_STATUS, None
+                )
+                # Lost a race with a concurrent check-in - report those as already marked too
+                lost = [student_id for student_id in to_insert if student_id not in inserted]
+                if lost:
+                    already_marked.update(await run_db(existing_attendance, db, lost, today))
+
+        results = []
+        for index, (face, (student_id, distance)) in enumerate(zip(faces, matches)):
+            result = {"face": index, "location": face["location"]}
+            student = students.get(student_id)
+            if student is None:
+                result["result"] = "unrecognized"
+                results.append(result)
+                continue
+
+            result.update({
+                "student": student.name,
+                "roll_number": student.roll_number,
+                "department": student.department,
+                "match_confidence": f"{(1 - distance) * 100:.2f}%"
+            })
+            if student_id in inserted:
+                result.update({"result": "marked", "status": GROUP_ATTENDANCE_STATUS})
+                attendance_feed.publish(institute.id, attendance_event(
+                    inserted[student_id], student.name, student.roll_number, student.department,
+                    mark_time, GROUP_ATTENDANCE_STATUS
+                ))
+            else:
+                existing = already_marked.get(student_id)
+                result.update({
+                    "result": "already_marked",
+                    "status": existing.status if existing else None,
+                    "time": existing.time.strftime("%H:%M:%S") if existing else None
+                })
+            results.append(result)
+
+        logger.info("Group attendance for institute %s: %s marked, %s already marked", institute.id, len(inserted), len(already_marked))
+
+        return {
+            "status": "success",
+            "message": f"Attendance marked for {len(inserted)} student(s) from {len(faces)} face(s)!",
+            "data": {
+                "faces_detected": len(faces),
+                "recognized": len(matched_ids),
+                "marked": len(inserted),
+                "already_marked": len(already_marked),
+                "unrecognized": len(faces) - len(matched_ids),
+                "results": results
+            }
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        await run_db(db.rollback)
+        logger.exception("Group attendance failed: %s", e)
+        return {
+            "status": "error",
+            "message": f"Group attendance marking failed: {str(e)}"
+        }
+
 @app.get("/admin/export-attendance/{institute_id}")
-async def export_attendance_excel(
+def export_attendance_excel(
     institute_id: int,
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    holiday_aware: bool = False,
+    export_format: str = Query("xlsx", alias="format"),
     db: Session = Depends(get_db)
 ):
-    """Export attendance to Excel"""
+    """Export attendance as xlsx (default), csv or parquet (defaults to the current month so far)"""
     try:
         institute = db.query(Institute).filter(Institute.id == institute_id).first()
         if not institute:
             raise HTTPException(status_code=404, detail="Institute not found")
         
         today = date.today()
-        first_day_of_month = date(today.year, today.month, 1)
-        
-        students = db.query(Student).filter(Student.institute_id == institute_id).all()
+        custom_range = date_from is not None or date_to is not None
+        date_from = date_from or date(today.year, today.month, 1)
+        date_to = date_to or today
         
-        attendance_records = db.query(Attendance).join(Student).filter(
-            Student.institute_id == institute_id,
-            Attendance.date >= first_day_of_month,
-            Attendance.date <= today
-        ).order_by(Attendance.date.desc()).all()
+        if date_from > date_to:
+            raise HTTPException(status_code=400, detail="'from' must be on or before 'to'")
         
-        output = BytesIO()
+        export_format = export_format.lower()
+        if export_format not in ["xlsx", "csv", "parquet"]:
+            raise HTTPException(status_code=400, detail="format must be one of: xlsx, csv, parquet")
         
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            workbook = writer.book
-            
-            # Sheet 1: Attendance Log
-            if attendance_records:
-                attendance_data = []
-                for record in attendance_records:
-                    attendance_data.append({
-                        'Date': record.date.strftime('%Y-%m-%d'),
-                        'Day': record.date.strftime('%A'),
-                        'Student Name': record.student.name,
-                        'Roll Number': record.student.roll_number,
-                        'Department': record.student.department,
-                        'Time': record.time.strftime('%H:%M:%S'),
-                        'Status': record.status,
-                        'Face Match': 'Yes' if record.face_match else 'No',
-                        'Dress Code': 'Compliant' if record.dress_code_match else 'Violation'
-                    })
-                
-                df_attendance = pd.DataFrame(attendance_data)
-            else:
-                df_attendance = pd.DataFrame(columns=[
-                    'Date', 'Day', 'Student Name', 'Roll Number', 'Department', 
-                    'Time', 'Status', 'Face Match', 'Dress Code'
-                ])
-            
-            df_attendance.to_excel(writer, sheet_name='Attendance Log', index=False)
-            
-            worksheet1 = writer.sheets['Attendance Log']
-            
-            header_format = workbook.add_format({
-                'bold': True,
-                'bg_color': '#3a4a44',
-                'font_color': 'white',
-                'border': 1,
-                'align': 'center'
-            })
-            
-            worksheet1.set_column('A:A', 12)
-            worksheet1.set_column('B:B', 12)
-            worksheet1.set_column('C:C', 20)
-            worksheet1.set_column('D:D', 15)
-            worksheet1.set_column('E:E', 15)
-            worksheet1.set_column('F:F', 12)
-            worksheet1.set_column('G:G', 25)
-            worksheet1.set_column('H:H', 12)
-            worksheet1.set_column('I:I', 15)
-            
-            for col_num, value in enumerate(df_attendance.columns.values):
-                worksheet1.write(0, col_num, value, header_format)
-            
-            # Sheet 2: Student Summary
-            student_summary = []
-            unique_dates = len(set([r.date for r in attendance_records])) if attendance_records else 0
-            
-            for student in students:
-                student_attendance = [r for r in attendance_records if r.student_id == student.id]
-                total_present = len(student_attendance)
-                compliant = len([r for r in student_attendance if r.dress_code_match])
-                violations = total_present - compliant
-                attendance_percentage = (total_present / unique_dates * 100) if unique_dates > 0 else 0
-                
-                student_summary.append({
-                    'Roll Number': student.roll_number,
-                    'Student Name': student.name,
-                    'Department': student.department,
-                    'Total Present': total_present,
-                    'Compliant': compliant,
-                    'Violations': violations,
-                    'Attendance %': f"{attendance_percentage:.1f}%"
-                })
-            
-            df_summary = pd.DataFrame(student_summary)
-            df_summary.to_excel(writer, sheet_name='Student Summary', index=False)
-            
-            worksheet2 = writer.sheets['Student Summary']
-            worksheet2.set_column('A:G', 15)
-            
-            for col_num, value in enumerate(df_summary.columns.values):
-                worksheet2.write(0, col_num, value, header_format)
+        institute_slug = institute.name.replace(' ', '_')
+        if custom_range:
+            filename = f"Attendance_{institute_slug}_{date_from.isoformat()}_to_{date_to.isoformat()}.{export_format}"
+        else:
+            filename = f"Attendance_{institute_slug}_{today.strftime('%B')}_{today.year}.{export_format}"
+        headers = {"Content-Disposition": f"attachment; filename={filename}"}
+        
+        if export_format == "csv":
+            # Rows are written to the response as they are read - nothing is buffered
+            return StreamingResponse(
+                iter_attendance_csv(institute_id, date_from, date_to),
+                media_type="text/csv",
+                headers=headers
+            )
         
-        output.seek(0)
+        if export_format == "parquet":
+            return StreamingResponse(
+                iter_file_chunks(write_attendance_parquet(db, institute_id, date_from, date_to)),
+                media_type="application/vnd.apache.parquet",
+                headers=headers
+            )
         
-        month_name = today.strftime('%B')
-        filename = f"Attendance_{institute.name.replace(' ', '_')}_{month_name}_{today.year}.xlsx"
+        output = write_attendance_xlsx(db, institute_id, date_from, date_to, holiday_aware=holiday_aware)
         
         return StreamingResponse(
-            output,
+            iter_file_chunks(output),
             media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
+            headers=headers
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"[ERROR] Excel generation failed: {str(e)}")
+        logger.error("Attendance export failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/admin/attendance/{institute_id}/clear")
-async def clear_all_attendance(
+def clear_all_attendance(
     institute_id: int,
     db: Session = Depends(get_db)
 ):
@@ -0,0 +1,305 @@
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds - check-in stages range from sub-ms gallery searches to multi-second ML calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Recent observations kept per series for the p50/p95/p99 summaries
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1024"))
+QUANTILES = (0.5, 0.95, 0.99)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+INF_LABEL = 'le="+Inf"'
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class Gauge(_Metric):
+    """Set directly, or computed at scrape time from a callback returning {label values tuple: value}"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 callback: Optional[Callable[[], Dict[Tuple, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self) -> List[str]:
+        if self.callback is not None:
+            try:
+                values = dict(self.callback())
+            except Exception as e:
+                logger.warning("Metric %s unavailable: %s", self.name, e)
+                values = {}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class _Series:
+    __slots__ = ("buckets", "total", "count", "window")
+
+    def __init__(self, bucket_count: int, window: int):
+        self.buckets = [0] * bucket_count
+        self.total = 0.0
+        self.count = 0
+        self.window = deque(maxlen=window)
+
+
+class Histogram(_Metric):
+    """Prometheus histogram plus a companion `<name>_recent` summary with p50/p95/p99 over
+    the last METRICS_WINDOW observations, so percentiles are readable without PromQL"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS, window: int = METRICS_WINDOW):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets))
+        self.window = window
+        self._series: Dict[Tuple, _Series] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(len(self.bounds), self.window)
+            index = bisect.bisect_left(self.bounds, value)
+            if index < len(self.bounds):
+                series.buckets[index] += 1
+            series.total += value
+            series.count += 1
+            series.window.append(value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def quantiles(self, **labels) -> Dict[float, float]:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            samples = sorted(series.window) if series else []
+        return _quantiles(samples)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = [
+                (key, list(s.buckets), s.total, s.count, sorted(s.window))
+                for key, s in sorted(self._series.items())
+            ]
+
+        lines = self.header()
+        for key, buckets, total, count, _ in snapshot:
+            cumulative = 0
+            for bound, hits in zip(self.bounds, buckets):
+                cumulative += hits
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, INF_LABEL)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+
+        recent = f"{self.name}_recent"
+        lines.append(f"# HELP {recent} {self.documentation} (last {self.window} observations)")
+        lines.append(f"# TYPE {recent} summary")
+        for key, _, _, _, samples in snapshot:
+            for quantile, value in _quantiles(samples).items():
+                q = f'quantile="{quantile}"'
+                lines.append(f"{recent}{_format_labels(self.labelnames, key, q)} {_format_value(value)}")
+            lines.append(f"{recent}_sum{_format_labels(self.labelnames, key)} {_format_value(sum(samples))}")
+            lines.append(f"{recent}_count{_format_labels(self.labelnames, key)} {len(samples)}")
+        return lines
+
+
+def _quantiles(samples: List[float]) -> Dict[float, float]:
+    if not samples:
+        return {}
+    return {q: samples[min(len(samples) - 1, int(round(q * (len(samples) - 1))))] for q in QUANTILES}
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# ========== APPLICATION METRICS ==========
+
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+))
+stage_duration = registry.register(Histogram(
+    "attendance_stage_duration_seconds", "Latency of one stage of a request (holiday check, gallery match...)",
+    ("stage",)
+))
+ml_request_duration = registry.register(Histogram(
+    "ml_request_duration_seconds", "ML service call latency including retries and hedges", ("endpoint",)
+))
+ml_errors = registry.register(Counter(
+    "ml_errors_total", "Failed ML service calls by endpoint and status (HTTP code, timeout, circuit_open...)",
+    ("endpoint", "status")
+))
+ml_retries = registry.register(Counter(
+    "ml_retries_total", "ML call attempts retried after a failure", ("endpoint",)
+))
+ml_hedges = registry.register(Counter(
+    "ml_hedged_requests_total", "Duplicate ML requests sent after the p95 delay", ("endpoint",)
+))
+ml_in_flight = registry.register(Gauge(
+    "ml_requests_in_flight", "ML service calls currently waiting for an answer"
+))
+db_query_duration = registry.register(Histogram(
+    "db_query_duration_seconds", "SQL statement latency by statement kind and table", ("group",)
+))
+log_records = registry.register(Counter(
+    "log_records_total", "Log records handed to the writer thread", ("level",)
+))
+log_records_dropped = registry.register(Counter(
+    "log_records_dropped_total", "Log records not written: DEBUG sampled out, or the queue was full", ("reason",)
+))
+log_emit_seconds = registry.register(Counter(
+    "log_emit_seconds_total", "Time callers spent handing records to the log queue"
+))
+log_records_per_request = registry.register(Histogram(
+    "log_records_per_request", "Log records written while serving one request",
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200)
+))
+
+
+@contextmanager
+def timed(stage: str):
+    """with timed("gallery_match"): ... - records one attendance_stage_duration_seconds observation"""
+    with stage_duration.time(stage=stage):
+        yield
+
+
+def gauge(name: str, documentation: str, callback: Callable[[], Dict[Tuple, float]],
+          labelnames: Iterable[str] = ()) -> Gauge:
+    """Register a gauge computed at scrape time"""
+    return registry.register(Gauge(name, documentation, labelnames, callback=callback))
+
+
+# ========== SQL QUERY GROUPS ==========
+
+_TABLE_PATTERN = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+\"?(\w+)", re.IGNORECASE)
+
+
+def query_group(statement: str) -> str:
+    """'SELECT students', 'INSERT attendance', ... - low-cardinality label for a SQL statement"""
+    words = statement.lstrip().split(None, 1)
+    verb = words[0].upper() if words else "OTHER"
+    match = _TABLE_PATTERN.search(statement)
+    return f"{verb} {match.group(1)}" if match else verb
+
+
+def instrument_engine(engine):
+    """Time every statement the engine runs, grouped by query_group()"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _stop(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("query_start")
+        if starts:
+            db_query_duration.observe(time.perf_counter() - starts.pop(), group=query_group(statement))
+
+    @event.listens_for(engine, "handle_error")
+    def _failed(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
@@ -0,0 +1,158 @@
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional
+
+
+class BatcherOverloaded(Exception):
+    """The queue is full - the caller should shed the request instead of waiting"""
+
+
+class MicroBatcher:
+    """Coalesce concurrent single-item calls into batches.
+
+    submit() queues an item and waits for its result. A collector task takes the
+    first waiting item, keeps gathering for up to `max_wait` seconds or until
+    `max_batch_size` items, and hands the batch to `process_batch`, which must
+    return one result (or Exception instance) per item in the same order.
+
+    Back-pressure: at most `max_concurrency` batches are in flight; while they are,
+    items pile up in a queue of `max_pending`, and submit() fails fast with
+    BatcherOverloaded once that is full. Each caller waits at most `timeout`
+    seconds; items that time out before dispatch are dropped from their batch.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int = 16,
+        max_wait: float = 0.005,
+        max_pending: int = 256,
+        max_concurrency: int = 4,
+        timeout: float = 30.0,
+        name: str = "batcher"
+    ):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.max_pending = max_pending
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.name = name
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._arrived: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._in_flight = set()
+
+    def start(self):
+        """Start the collector on the running loop (submit() also does this lazily)"""
+        if self._collector is None or self._collector.done():
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._arrived = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._collector = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        """Stop collecting, wait for batches in flight, fail anything still queued"""
+        if self._collector is None:
+            return
+
+        self._collector.cancel()
+        try:
+            await self._collector
+        except asyncio.CancelledError:
+            pass
+        self._collector = None
+
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(BatcherOverloaded(f"{self.name} is shutting down"))
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, item) -> Any:
+        self.start()
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((item, future))
+        except asyncio.QueueFull:
+            raise BatcherOverloaded(f"{self.name} has {self.max_pending} requests waiting")
+        self._arrived.set()
+
+        # On timeout wait_for cancels the future, and the collector skips it
+        return await asyncio.wait_for(future, timeout=self.timeout)
+
+    async def _next_item(self, timeout: Optional[float] = None):
+        """Next queued (item, future), or None after `timeout` seconds.
+
+        Items are only taken with get_nowait() - the timeout applies to waiting for
+        the arrival event, so it can never discard an item already dequeued.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            try:
+                return self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            self._arrived.clear()
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return None
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Hold a slot before gathering, so a saturated backend makes items queue up here
+            await self._slots.acquire()
+            try:
+                batch = [await self._next_item()]
+                deadline = loop.time() + self.max_wait
+
+                while len(batch) < self.max_batch_size:
+                    entry = await self._next_item(deadline - loop.time())
+                    if entry is None:
+                        break
+                    batch.append(entry)
+            except BaseException:
+                self._slots.release()
+                raise
+
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                self._slots.release()
+                continue
+
+            task = asyncio.create_task(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(self, batch):
+        try:
+            try:
+                results = await self.process_batch([item for item, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.name}: got {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                results = [e] * len(batch)
+
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            self._slots.release()
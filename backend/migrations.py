@@ -0,0 +1,196 @@
+"""One-off schema/data migrations.
+
+Run from the backend directory:
+
+    python migrations.py            # apply every migration (each one is idempotent)
+    python migrations.py <name>     # apply a single migration
+"""
+import sys
+
+from sqlalchemy import text
+
+from database import engine
+from face_gallery import face_encoding_to_bytes
+
+BATCH_SIZE = 500
+
+
+def _column_type(conn, table: str, column: str):
+    return conn.execute(text("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name = :table AND column_name = :column
+    """), {"table": table, "column": column}).scalar()
+
+
+def _convert_face_encodings(conn, limit: int) -> int:
+    """Fill face_encoding_bin for up to `limit` unconverted rows; returns how many were converted"""
+    rows = conn.execute(text("""
+        SELECT id, face_encoding FROM students
+        WHERE face_encoding_bin IS NULL
+        ORDER BY id
+        LIMIT :limit
+    """), {"limit": limit}).all()
+
+    if rows:
+        conn.execute(
+            text("UPDATE students SET face_encoding_bin = :data WHERE id = :id"),
+            [{"id": row.id, "data": face_encoding_to_bytes(row.face_encoding)} for row in rows]
+        )
+    return len(rows)
+
+
+def face_encoding_binary():
+    """students.face_encoding: serialized text -> packed float32 bytea"""
+    with engine.begin() as conn:
+        if _column_type(conn, "students", "face_encoding") == "bytea":
+            print("[MIGRATION] students.face_encoding is already bytea - skipping")
+            return
+
+        conn.execute(text("ALTER TABLE students ADD COLUMN IF NOT EXISTS face_encoding_bin BYTEA"))
+
+    converted = 0
+    while True:
+        # Convert in small committed batches so a large table never holds one long transaction
+        with engine.begin() as conn:
+            count = _convert_face_encodings(conn, BATCH_SIZE)
+
+        if not count:
+            break
+        converted += count
+        print(f"[MIGRATION] Converted {converted} face encodings")
+
+    with engine.begin() as conn:
+        # Writers are blocked from here on: students registered while the batches ran are
+        # converted here, and none can slip in between the last conversion and the column swap
+        conn.execute(text("LOCK TABLE students IN ACCESS EXCLUSIVE MODE"))
+        while True:
+            count = _convert_face_encodings(conn, BATCH_SIZE)
+            if not count:
+                break
+            converted += count
+            print(f"[MIGRATION] Converted {count} face encodings written during the migration")
+
+        conn.execute(text("ALTER TABLE students DROP COLUMN face_encoding"))
+        conn.execute(text("ALTER TABLE students RENAME COLUMN face_encoding_bin TO face_encoding"))
+        conn.execute(text("ALTER TABLE students ALTER COLUMN face_encoding SET NOT NULL"))
+
+    print(f"[MIGRATION] students.face_encoding is now bytea ({converted} rows converted)")
+
+
+def dress_code_features():
+    """dress_codes.clothing_features: cached reference features (backfilled lazily at runtime)"""
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE dress_codes ADD COLUMN IF NOT EXISTS clothing_features TEXT"))
+
+    print("[MIGRATION] dress_codes.clothing_features is present")
+
+
+def attendance_indexes():
+    """Unique (student_id, date) + covering (date, student_id) on attendance, unique (institute_id, roll_number) on students"""
+    with engine.begin() as conn:
+        # Students registered twice by the old check-then-insert race would block the unique roll
+        # number index. The oldest row is kept and the duplicates' attendance is moved onto it.
+        keepers = """
+            SELECT id, MIN(id) OVER (PARTITION BY institute_id, roll_number) AS keep_id FROM students
+        """
+
+        # Rows double-marked by the old check-then-insert race (or by two copies of one student)
+        # would block the unique (student_id, date) index
+        removed = conn.execute(text(f"""
+            WITH keep AS ({keepers})
+            DELETE FROM attendance a
+            USING keep ka, attendance b, keep kb
+            WHERE a.student_id = ka.id
+              AND b.student_id = kb.id
+              AND ka.keep_id = kb.keep_id
+              AND a.date = b.date
+              AND a.id > b.id
+        """)).rowcount
+        print(f"[MIGRATION] Removed {removed} duplicate attendance rows")
+
+        moved = conn.execute(text(f"""
+            WITH keep AS ({keepers})
+            UPDATE attendance SET student_id = keep.keep_id
+            FROM keep
+            WHERE attendance.student_id = keep.id AND keep.id <> keep.keep_id
+        """)).rowcount
+        merged = conn.execute(text("""
+            DELETE FROM students s
+            USING students t
+            WHERE s.institute_id = t.institute_id
+              AND s.roll_number = t.roll_number
+              AND s.id > t.id
+        """)).rowcount
+        print(f"[MIGRATION] Removed {merged} duplicate students ({moved} attendance rows moved to the kept record)")
+
+    statements = [
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_attendance_student_date "
+        "ON attendance (student_id, date)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_attendance_date_student "
+        "ON attendance (date, student_id) INCLUDE (time, status, face_match, dress_code_match)",
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_student_institute_roll "
+        "ON students (institute_id, roll_number)",
+    ]
+
+    # CONCURRENTLY can't run inside a transaction block, and keeps the tables writable meanwhile
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # A failed CONCURRENTLY build leaves an INVALID index that IF NOT EXISTS would keep forever,
+        # and an earlier run of this migration built idx_student_institute_roll without UNIQUE
+        stale = conn.execute(text("""
+            SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname IN
+                ('idx_attendance_student_date', 'idx_attendance_date_student', 'idx_student_institute_roll')
+              AND (NOT i.indisvalid OR (c.relname = 'idx_student_institute_roll' AND NOT i.indisunique))
+        """)).scalars().all()
+        for name in stale:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            print(f"[MIGRATION] Dropped invalid or non-unique index {name}")
+
+        for statement in statements:
+            conn.execute(text(statement))
+            print(f"[MIGRATION] {statement}")
+
+
+def job_queue():
+    """background_jobs table for the durable job queue (see job_queue.py)"""
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS background_jobs (
+                id SERIAL PRIMARY KEY,
+                kind VARCHAR(50) NOT NULL,
+                payload TEXT NOT NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 5,
+                run_after TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+                locked_at TIMESTAMP,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc'),
+                updated_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+            )
+        """))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_background_jobs_claim ON background_jobs (status, run_after)"
+        ))
+
+    print("[MIGRATION] background_jobs table is present")
+
+
+MIGRATIONS = {
+    "face_encoding_binary": face_encoding_binary,
+    "dress_code_features": dress_code_features,
+    "attendance_indexes": attendance_indexes,
+    "job_queue": job_queue,
+}
+
+
+def run(names=None):
+    for name in names or MIGRATIONS:
+        if name not in MIGRATIONS:
+            raise SystemExit(f"Unknown migration: {name}. Available: {', '.join(MIGRATIONS)}")
+        print(f"[MIGRATION] Running {name}")
+        MIGRATIONS[name]()
+
+
+if __name__ == "__main__":
+    run(sys.argv[1:])
@@ -0,0 +1,268 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional
+
+import httpx
+
+from metrics import ml_retries, ml_hedges
+
+logger = logging.getLogger(__name__)
+
+# Total time one ML call may take, retries and hedges included (seconds)
+DEFAULT_ENDPOINT_BUDGETS = {
+    "/extract-face": 20.0,
+    "/extract-face-batch": 30.0,
+    "/extract-faces": 30.0,
+    "/extract-clothing": 20.0,
+    "/compare-clothing": 10.0,
+    "/check-liveness": 10.0,
+    "/check-face-covered": 10.0,
+    "/check-screen-proxy": 10.0,
+}
+ML_DEFAULT_BUDGET = float(os.getenv("ML_DEFAULT_BUDGET", "20"))
+# JSON object overriding single budgets, e.g. {"/extract-face": 15}
+ML_ENDPOINT_BUDGETS = {**DEFAULT_ENDPOINT_BUDGETS, **json.loads(os.getenv("ML_ENDPOINT_BUDGETS", "{}"))}
+
+ML_RETRIES = int(os.getenv("ML_RETRIES", "2"))
+ML_RETRY_BACKOFF = float(os.getenv("ML_RETRY_BACKOFF", "0.2"))
+ML_RETRY_BACKOFF_MAX = float(os.getenv("ML_RETRY_BACKOFF_MAX", "2"))
+
+ML_HEDGE = os.getenv("ML_HEDGE", "true").lower() in ["true", "1", "yes"]
+ML_HEDGE_PERCENTILE = float(os.getenv("ML_HEDGE_PERCENTILE", "95"))
+ML_HEDGE_MIN_SAMPLES = int(os.getenv("ML_HEDGE_MIN_SAMPLES", "20"))
+# Batches are expensive - duplicating them would double the load we are trying to shed
+ML_NO_HEDGE_ENDPOINTS = {"/extract-face-batch"}
+
+ML_BREAKER_FAILURES = int(os.getenv("ML_BREAKER_FAILURES", "5"))
+ML_BREAKER_RESET = float(os.getenv("ML_BREAKER_RESET", "30"))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+LATENCY_WINDOW = 200
+
+
+class CircuitOpenError(Exception):
+    """The breaker is open: fail fast instead of queueing on a service that is down"""
+
+
+class LatencyTracker:
+    """Recent successful-call latencies per endpoint"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, endpoint: str, pct: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(endpoint, ()))
+        if len(samples) < max(1, min_samples):
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            endpoints = list(self._samples)
+        return {
+            endpoint: {
+                "samples": len(self._samples[endpoint]),
+                "p50_ms": round(self.percentile(endpoint, 50) * 1000, 1),
+                "p95_ms": round(self.percentile(endpoint, 95) * 1000, 1),
+            }
+            for endpoint in endpoints
+        }
+
+
+class CircuitBreaker:
+    """closed -> open after `failure_threshold` consecutive failed calls; open -> half_open
+    after `reset_timeout` seconds, where a single probe decides between closed and open again"""
+
+    def __init__(self, failure_threshold: int = ML_BREAKER_FAILURES, reset_timeout: float = ML_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error: Optional[str] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def abandon(self):
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info("ML circuit breaker closed")
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self, error: str):
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            self._probing = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning("ML circuit breaker opened after %s failures: %s", self.failures, error)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            retry_in = 0.0
+            if self.state == "open":
+                retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "retry_in_seconds": round(retry_in, 1),
+                "last_error": self.last_error,
+            }
+
+
+class _Attempt(NamedTuple):
+    response: Optional[httpx.Response]
+    error: Optional[Exception]
+
+
+def _retryable(attempt: _Attempt) -> bool:
+    if attempt.error is not None:
+        return isinstance(attempt.error, (httpx.TransportError, asyncio.TimeoutError))
+    return attempt.response.status_code in RETRYABLE_STATUS
+
+
+class ResilientCaller:
+    """Budgets, jittered retries, hedged requests and a circuit breaker around ML POSTs.
+
+    Every ML endpoint is a pure function of its input, so retrying or duplicating
+    a request is safe. Non-retryable responses (4xx other than 429) are returned
+    as-is for the caller to handle.
+    """
+
+    def __init__(self, breaker: Optional[CircuitBreaker] = None, latencies: Optional[LatencyTracker] = None):
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = latencies or LatencyTracker()
+
+    def budget(self, endpoint: str) -> float:
+        return float(ML_ENDPOINT_BUDGETS.get(endpoint, ML_DEFAULT_BUDGET))
+
+    def hedge_delay(self, endpoint: str) -> Optional[float]:
+        if not ML_HEDGE or endpoint in ML_NO_HEDGE_ENDPOINTS:
+            return None
+        return self.latencies.percentile(endpoint, ML_HEDGE_PERCENTILE, ML_HEDGE_MIN_SAMPLES)
+
+    async def post(self, send: Callable[[], Awaitable[httpx.Response]], endpoint: str) -> httpx.Response:
+        """Run send() under the endpoint's budget; raises CircuitOpenError, asyncio.TimeoutError or the last httpx error"""
+        if not self.breaker.allow():
+            raise CircuitOpenError(endpoint)
+
+        try:
+            return await self._post(send, endpoint)
+        except asyncio.CancelledError:
+            # The caller went away; don't leave a half-open breaker waiting on this probe forever
+            self.breaker.abandon()
+            raise
+
+    async def _post(self, send, endpoint: str) -> httpx.Response:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.budget(endpoint)
+        attempt = _Attempt(None, asyncio.TimeoutError())
+
+        for retry in range(ML_RETRIES + 1):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            if retry:
+                backoff = random.uniform(0, min(ML_RETRY_BACKOFF_MAX, ML_RETRY_BACKOFF * 2 ** retry))
+                if backoff >= remaining:
+                    break
+                await asyncio.sleep(backoff)
+                remaining = deadline - loop.time()
+                ml_retries.inc(endpoint=endpoint)
+                logger.debug("Retrying ML call %s (%s/%s)", endpoint, retry, ML_RETRIES)
+
+            try:
+                attempt = _Attempt(await asyncio.wait_for(self._hedged(send, endpoint), timeout=remaining), None)
+            except (httpx.HTTPError, asyncio.TimeoutError) as e:
+                attempt = _Attempt(None, e)
+
+            if not _retryable(attempt):
+                break
+
+        if _retryable(attempt):
+            if attempt.error is not None:
+                error = type(attempt.error).__name__
+            else:
+                error = f"HTTP {attempt.response.status_code}"
+            self.breaker.record_failure(f"{endpoint}: {error}")
+        else:
+            self.breaker.record_success()
+
+        if attempt.error is not None:
+            raise attempt.error
+        return attempt.response
+
+    async def _timed(self, send, endpoint: str) -> httpx.Response:
+        start = time.perf_counter()
+        response = await send()
+        if response.status_code < 500:
+            self.latencies.record(endpoint, time.perf_counter() - start)
+        return response
+
+    async def _hedged(self, send, endpoint: str) -> httpx.Response:
+        """send(); if it has not answered by the endpoint's p95, race a duplicate and keep the first good answer"""
+        delay = self.hedge_delay(endpoint)
+        tasks = {asyncio.create_task(self._timed(send, endpoint))}
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    ml_hedges.inc(endpoint=endpoint)
+                    logger.debug("Hedging ML call %s after %.0f ms", endpoint, delay * 1000)
+                    tasks.add(asyncio.create_task(self._timed(send, endpoint)))
+
+            last = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    last = task
+                    if task.exception() is None and task.result().status_code not in RETRYABLE_STATUS:
+                        return task.result()
+            return last.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def snapshot(self) -> dict:
+        return {
+            "circuit_breaker": self.breaker.snapshot(),
+            "latency": self.latencies.snapshot(),
+        }
+
+
+ml_resilience = ResilientCaller()
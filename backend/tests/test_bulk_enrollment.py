@@ -0,0 +1,57 @@
+import pytest
+
+import bulk_enrollment
+from bulk_enrollment import parse_manifest
+
+PHOTOS = {
+    "r1.jpg": "photos/R1.jpg", "r1": "photos/R1.jpg",
+    "r2.png": "R2.png", "r2": "R2.png",
+    "alice_smith.jpg": "alice_smith.jpg", "alice_smith": "alice_smith.jpg",
+}
+
+
+def test_rows_matched_by_roll_number_and_photo_column():
+    text = (
+        "\ufeffName,Roll_Number,Department,Photo\n"
+        "Bob,R1,CS,\n"
+        "Carol,R2,EE,\n"
+        "Alice,R9,ME,alice_smith.jpg\n"
+    )
+
+    rows, rejected = parse_manifest(text, PHOTOS)
+
+    assert rejected == []
+    assert [(r.line, r.roll_number, r.photo) for r in rows] == [
+        (2, "R1", "photos/R1.jpg"), (3, "R2", "R2.png"), (4, "R9", "alice_smith.jpg")
+    ]
+
+
+def test_invalid_rows_are_rejected_with_a_reason():
+    text = (
+        "name,roll_number,department\n"
+        "Bob,R1,CS\n"
+        ",R2,EE\n"
+        "Dup,R1,CS\n"
+        "Nobody,R7,CS\n"
+    )
+
+    rows, rejected = parse_manifest(text, PHOTOS)
+
+    assert [r.roll_number for r in rows] == ["R1"]
+    assert rejected == [
+        {"line": 3, "roll_number": "R2", "reason": "name, roll_number and department are required"},
+        {"line": 4, "roll_number": "R1", "reason": "duplicate roll number in manifest"},
+        {"line": 5, "roll_number": "R7", "reason": "no photo in ZIP"},
+    ]
+
+
+def test_missing_columns():
+    with pytest.raises(ValueError, match="department"):
+        parse_manifest("name,roll_number\nBob,R1\n", PHOTOS)
+
+
+def test_row_limit(monkeypatch):
+    monkeypatch.setattr(bulk_enrollment, "BULK_ENROLL_MAX_ROWS", 1)
+
+    with pytest.raises(ValueError, match="limit"):
+        parse_manifest("name,roll_number,department\nBob,R1,CS\nCarol,R2,EE\n", PHOTOS)
@@ -0,0 +1,61 @@
+import calendar_cache
+from calendar_cache import TTLLRUCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(calendar_cache.time, "monotonic", clock)
+    cache = TTLLRUCache(maxsize=10, ttl=60)
+
+    cache.set("a", 1)
+    clock.now += 59
+    assert cache.get("a") == 1
+
+    clock.now += 2
+    assert cache.get("a") is None
+
+
+def test_set_refreshes_the_expiry(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(calendar_cache.time, "monotonic", clock)
+    cache = TTLLRUCache(maxsize=10, ttl=60)
+
+    cache.set("a", 1)
+    clock.now += 50
+    cache.set("a", 2)
+    clock.now += 50
+
+    assert cache.get("a") == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLLRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_pop_and_pop_where():
+    cache = TTLLRUCache(maxsize=10, ttl=60)
+    for key in [(1, 2024, 1), (1, 2024, 2), (2, 2024, 1)]:
+        cache.set(key, key)
+
+    cache.pop((2, 2024, 1))
+    cache.pop("missing")
+    cache.pop_where(lambda key: key[0] == 1)
+
+    assert all(cache.get(key) is None for key in [(1, 2024, 1), (1, 2024, 2), (2, 2024, 1)])
@@ -0,0 +1,235 @@
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from ann_index import IVFIndex
+from database import Base, Institute, Student
+from face_gallery import FaceGallery, GalleryManager, NO_MATCH_DISTANCE, face_encoding_to_bytes
+
+
+def random_faces(count, dim=128, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(count, dim)).astype(np.float32)
+
+
+def clustered_faces(count, clusters=40, dim=128, spread=0.15, seed=0):
+    """Faces bunched around a few centres, like real embeddings - IVF cells mean something here"""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim))
+    return (centres[rng.integers(clusters, size=count)] + spread * rng.normal(size=(count, dim))).astype(np.float32)
+
+
+# ========== FACE GALLERY ==========
+
+def test_best_match_finds_the_registered_face():
+    faces = random_faces(20)
+    gallery = FaceGallery(range(100, 120), faces)
+
+    student_id, distance = gallery.best_match(faces[7] + 0.01)
+
+    assert student_id == 107
+    assert distance < 0.01
+
+
+def test_best_match_rejects_faces_over_threshold():
+    faces = random_faces(20)
+    gallery = FaceGallery(range(10), faces[:10])
+
+    assert gallery.best_match(faces[15]) == (None, NO_MATCH_DISTANCE)
+
+
+def test_empty_gallery():
+    gallery = FaceGallery([], [])
+
+    assert len(gallery) == 0
+    assert gallery.version == (0, 0)
+    assert gallery.best_match(random_faces(1)[0]) == (None, NO_MATCH_DISTANCE)
+    ids, distances = gallery.search(random_faces(1)[0])
+    assert ids.size == 0 and distances.size == 0
+    assert gallery.match_many([random_faces(1)[0]]) == [(None, NO_MATCH_DISTANCE)]
+    assert gallery.refresh_index() is False
+
+
+def test_empty_gallery_accepts_first_registration():
+    gallery = FaceGallery([], [])
+    face = random_faces(1)[0]
+
+    gallery.add(1, face_encoding_to_bytes(face))
+
+    assert gallery.best_match(face)[0] == 1
+
+
+def test_add_and_remove_keep_rows_and_version_consistent():
+    faces = random_faces(40)
+    gallery = FaceGallery(range(1, 21), faces[:20])
+    assert gallery.version == (20, 20)
+
+    for n in range(20, 40):
+        gallery.add(n + 1, faces[n])
+    assert gallery.version == (40, 40)
+
+    assert gallery.remove(5)
+    assert not gallery.remove(5)
+    assert 5 not in gallery
+    assert gallery.version == (39, 40)
+
+    # The last row moved into the hole and is still found under its own id
+    assert gallery.best_match(faces[39])[0] == 40
+    assert gallery.best_match(faces[4])[0] is None
+
+
+def test_add_rejects_other_dimensions():
+    gallery = FaceGallery([1], random_faces(1, dim=128))
+
+    with pytest.raises(ValueError):
+        gallery.add(2, random_faces(1, dim=64)[0])
+
+
+def test_match_many_assigns_each_student_once():
+    faces = random_faces(5)
+    gallery = FaceGallery(range(5), faces)
+
+    # Two faces closest to student 2: only the closer one gets it
+    results = gallery.match_many([faces[2] + 0.001, faces[2] + 0.05, faces[4]])
+
+    assert results[0][0] == 2
+    assert results[1][0] != 2
+    assert results[2][0] == 4
+
+
+# ========== IVF INDEX ==========
+
+def test_ivf_search_recall_against_exact_scan():
+    faces = clustered_faces(3000)
+    gallery = FaceGallery(range(3000), faces, ann_min_size=1000, index=IVFIndex(n_lists=40, n_probe=4))
+    assert gallery.refresh_index()
+
+    rng = np.random.default_rng(1)
+    probes = faces[rng.choice(len(faces), 200, replace=False)] + 0.02 * rng.normal(size=(200, 128))
+    hits = sum(
+        int(gallery.search(probe, k=1)[0][0]) == int(gallery.search(probe, k=1, exact=True)[0][0])
+        for probe in probes
+    )
+
+    assert hits / len(probes) >= 0.95
+
+
+def test_ivf_candidates_are_a_subset():
+    faces = clustered_faces(2000)
+    gallery = FaceGallery(range(2000), faces, ann_min_size=1000, index=IVFIndex(n_lists=40, n_probe=2))
+    gallery.refresh_index()
+
+    rows = gallery._index.candidates(gallery.matrix[0], gallery._labels[:len(gallery)])
+
+    assert 0 < len(rows) < len(gallery)
+
+
+def test_untrained_large_gallery_scans_exactly():
+    faces = clustered_faces(1200)
+    gallery = FaceGallery(range(1200), faces, ann_min_size=1000)
+
+    # Searches never train the index themselves
+    assert gallery.best_match(faces[3])[0] == 3
+    assert not gallery._index.is_trained
+
+
+def test_ivf_index_refuses_empty_training_set():
+    with pytest.raises(ValueError):
+        IVFIndex().train(np.empty((0, 128), dtype=np.float32))
+
+
+def test_stale_training_result_is_discarded(monkeypatch):
+    faces = clustered_faces(1100)
+    gallery = FaceGallery(range(1000), faces[:1000], ann_min_size=1000, index=IVFIndex(n_lists=20))
+    train = IVFIndex.train
+
+    def train_while_a_student_registers(index, matrix):
+        # A registration lands while k-means runs on the snapshot
+        if 5000 not in gallery:
+            gallery.add(5000, faces[1050])
+        train(index, matrix)
+
+    monkeypatch.setattr(IVFIndex, "train", train_while_a_student_registers)
+    assert gallery.build_index() is False
+    assert not gallery._index.is_trained
+
+    assert gallery.build_index() is True
+    assert gallery.best_match(faces[1050])[0] == 5000
+
+
+# ========== GALLERY MANAGER ==========
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine, tables=[Institute.__table__, Student.__table__])
+    session = sessionmaker(bind=engine)()
+    session.add(Institute(id=1, name="Test Institute"))
+    session.commit()
+    yield session
+    session.close()
+
+
+def add_student(db, student_id, face):
+    db.add(Student(
+        id=student_id, name=f"Student {student_id}", roll_number=str(student_id), department="CS",
+        institute_id=1, face_encoding=face_encoding_to_bytes(face)
+    ))
+    db.commit()
+
+
+def test_manager_reuses_gallery_while_version_matches(db):
+    faces = random_faces(3)
+    add_student(db, 1, faces[0])
+    add_student(db, 2, faces[1])
+    manager = GalleryManager()
+
+    gallery = manager.get(db, 1)
+    assert gallery.version == (2, 2)
+    assert manager.get(db, 1) is gallery
+
+    # Registered through this worker: patched in place, no rebuild
+    add_student(db, 3, faces[2])
+    manager.add_student(1, 3, face_encoding_to_bytes(faces[2]))
+    assert manager.get(db, 1) is gallery
+    assert gallery.best_match(faces[2])[0] == 3
+
+
+def test_manager_rebuilds_when_database_drifts(db):
+    faces = random_faces(3)
+    add_student(db, 1, faces[0])
+    add_student(db, 2, faces[1])
+    manager = GalleryManager()
+    gallery = manager.get(db, 1)
+
+    # Registered by another worker: the (count, max id) stamp no longer matches
+    add_student(db, 3, faces[2])
+    rebuilt = manager.get(db, 1)
+
+    assert rebuilt is not gallery
+    assert rebuilt.version == (3, 3)
+    assert rebuilt.best_match(faces[2])[0] == 3
+
+
+def test_manager_add_student_leaves_unloaded_gallery_alone(db):
+    manager = GalleryManager()
+
+    manager.add_student(1, 1, face_encoding_to_bytes(random_faces(1)[0]))
+
+    assert manager.get(db, 1).version == (0, 0)
+
+
+def test_manager_remove_and_invalidate(db):
+    faces = random_faces(2)
+    add_student(db, 1, faces[0])
+    add_student(db, 2, faces[1])
+    manager = GalleryManager()
+    gallery = manager.get(db, 1)
+
+    manager.remove_student(1, 1)
+    assert 1 not in gallery
+
+    manager.invalidate(1)
+    assert manager.get(db, 1) is not gallery
@@ -0,0 +1,66 @@
+from metrics import Counter, Gauge, Histogram, Registry, query_group
+
+
+def render(*metrics):
+    registry = Registry()
+    for metric in metrics:
+        registry.register(metric)
+    return registry.render().splitlines()
+
+
+def test_counter_text_format():
+    errors = Counter("ml_errors_total", "Failed ML calls", ("endpoint", "status"))
+    errors.inc(endpoint="/extract-face", status=503)
+    errors.inc(endpoint="/extract-face", status=503)
+    errors.inc(endpoint='/odd"name', status="timeout")
+
+    assert render(errors) == [
+        "# HELP ml_errors_total Failed ML calls",
+        "# TYPE ml_errors_total counter",
+        'ml_errors_total{endpoint="/extract-face",status="503"} 2',
+        'ml_errors_total{endpoint="/odd\\"name",status="timeout"} 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    latency = Histogram("stage_seconds", "Stage latency", ("stage",), buckets=(0.1, 1.0), window=10)
+    for value in (0.05, 0.5, 0.5, 3.0):
+        latency.observe(value, stage="match")
+
+    lines = render(latency)
+
+    assert 'stage_seconds_bucket{stage="match",le="0.1"} 1' in lines
+    assert 'stage_seconds_bucket{stage="match",le="1"} 3' in lines
+    assert 'stage_seconds_bucket{stage="match",le="+Inf"} 4' in lines
+    assert 'stage_seconds_sum{stage="match"} 4.05' in lines
+    assert 'stage_seconds_count{stage="match"} 4' in lines
+    assert "# TYPE stage_seconds_recent summary" in lines
+    assert 'stage_seconds_recent{stage="match",quantile="0.5"} 0.5' in lines
+    assert 'stage_seconds_recent{stage="match",quantile="0.99"} 3' in lines
+    assert 'stage_seconds_recent_count{stage="match"} 4' in lines
+
+
+def test_histogram_window_keeps_recent_observations():
+    latency = Histogram("window_seconds", "Latency", window=3)
+    for value in (10.0, 1.0, 2.0, 3.0):
+        latency.observe(value)
+
+    assert latency.quantiles() == {0.5: 2.0, 0.95: 3.0, 0.99: 3.0}
+
+
+def test_gauge_callback_and_failure():
+    pool = Gauge("pool", "Pool size", ("state",), callback=lambda: {("idle",): 3, ("busy",): 1})
+    broken = Gauge("broken", "Unavailable", callback=lambda: 1 / 0)
+
+    lines = render(pool, broken)
+
+    assert 'pool{state="busy"} 1' in lines
+    assert 'pool{state="idle"} 3' in lines
+    assert lines[-2:] == ["# HELP broken Unavailable", "# TYPE broken gauge"]
+
+
+def test_query_group():
+    assert query_group("SELECT students.id FROM students WHERE 1") == "SELECT students"
+    assert query_group('INSERT INTO "attendance" (a) VALUES (1)') == "INSERT attendance"
+    assert query_group("UPDATE background_jobs SET status = 'x'") == "UPDATE background_jobs"
+    assert query_group("BEGIN") == "BEGIN"
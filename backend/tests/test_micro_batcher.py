@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+
+from micro_batcher import BatcherOverloaded, MicroBatcher
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_concurrent_submits_are_coalesced():
+    batches = []
+
+    async def process(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    async def scenario():
+        batcher = MicroBatcher(process, max_batch_size=4, max_wait=0.05)
+        try:
+            return await asyncio.gather(*(batcher.submit(n) for n in range(10)))
+        finally:
+            await batcher.stop()
+
+    assert run(scenario()) == [n * 2 for n in range(10)]
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert sorted(item for batch in batches for item in batch) == list(range(10))
+
+
+def test_lone_item_is_sent_after_max_wait():
+    async def process(items):
+        return items
+
+    async def scenario():
+        batcher = MicroBatcher(process, max_wait=0.01)
+        try:
+            return await asyncio.wait_for(batcher.submit("only"), timeout=1)
+        finally:
+            await batcher.stop()
+
+    assert run(scenario()) == "only"
+
+
+def test_item_after_a_timed_out_wait_is_not_lost():
+    async def process(items):
+        return items
+
+    async def scenario():
+        batcher = MicroBatcher(process, max_batch_size=8, max_wait=0.01)
+        try:
+            first = await batcher.submit(1)
+            # Arrives after the collector's wait ran out and it went back to waiting
+            await asyncio.sleep(0.05)
+            second = await asyncio.wait_for(batcher.submit(2), timeout=1)
+            return first, second
+        finally:
+            await batcher.stop()
+
+    assert run(scenario()) == (1, 2)
+
+
+def test_per_item_exceptions_reach_only_their_caller():
+    async def process(items):
+        return [ValueError(f"bad {item}") if item % 2 else item for item in items]
+
+    async def scenario():
+        batcher = MicroBatcher(process, max_wait=0.01)
+        try:
+            return await asyncio.gather(*(batcher.submit(n) for n in range(4)), return_exceptions=True)
+        finally:
+            await batcher.stop()
+
+    results = run(scenario())
+    assert results[0] == 0 and results[2] == 2
+    assert isinstance(results[1], ValueError) and isinstance(results[3], ValueError)
+
+
+def test_wrong_result_count_fails_the_whole_batch():
+    async def process(items):
+        return items[:1]
+
+    async def scenario():
+        batcher = MicroBatcher(process, max_batch_size=2, max_wait=0.05)
+        try:
+            return await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+        finally:
+            await batcher.stop()
+
+    assert all(isinstance(result, RuntimeError) for result in run(scenario()))
+
+
+def test_full_queue_fails_fast():
+    release = None
+
+    async def process(items):
+        await release.wait()
+        return items
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        batcher = MicroBatcher(process, max_batch_size=1, max_wait=0, max_pending=2, max_concurrency=1)
+        # The first item is dispatched and blocks the only slot; the next two fill the queue
+        waiting = [asyncio.create_task(batcher.submit(0))]
+        await asyncio.sleep(0.01)
+        waiting += [asyncio.create_task(batcher.submit(n)) for n in (1, 2)]
+        await asyncio.sleep(0.01)
+        try:
+            with pytest.raises(BatcherOverloaded):
+                await batcher.submit(99)
+        finally:
+            release.set()
+            results = await asyncio.gather(*waiting)
+            await batcher.stop()
+        return results
+
+    assert run(scenario()) == [0, 1, 2]
+
+
+# ========== /extract-face-batch FALLBACK ==========
+
+def test_face_batch_falls_back_to_single_calls_on_404(monkeypatch):
+    import main
+    from image_payload import ImagePayload
+
+    calls = []
+
+    async def fake_call_ml_service(endpoint, data, optional=False):
+        calls.append(endpoint)
+        if endpoint == main.ML_FACE_BATCH_ENDPOINT:
+            raise main.MLEndpointMissing(endpoint)
+        return {"status": "success", "face_encoding": data["image_base64"]}
+
+    monkeypatch.setattr(main, "call_ml_service", fake_call_ml_service)
+    monkeypatch.setattr(main, "face_batch_supported", True)
+    images = [ImagePayload(b"a"), ImagePayload(b"b")]
+
+    results = run(main.extract_face_batch(images))
+    assert [r["face_encoding"] for r in results] == [images[0].base64, images[1].base64]
+    assert calls == [main.ML_FACE_BATCH_ENDPOINT, "/extract-face", "/extract-face"]
+
+    # The missing endpoint is remembered - later batches go straight to single calls
+    calls.clear()
+    run(main.extract_face_batch(images))
+    assert calls == ["/extract-face", "/extract-face"]
+
+
+def test_face_batch_uses_batch_endpoint_when_available(monkeypatch):
+    import main
+    from image_payload import ImagePayload
+
+    calls = []
+
+    async def fake_call_ml_service(endpoint, data, optional=False):
+        calls.append(endpoint)
+        return {"status": "success", "results": [{"status": "success"} for _ in data["images"]]}
+
+    monkeypatch.setattr(main, "call_ml_service", fake_call_ml_service)
+    monkeypatch.setattr(main, "face_batch_supported", True)
+
+    results = run(main.extract_face_batch([ImagePayload(b"a"), ImagePayload(b"b"), ImagePayload(b"c")]))
+
+    assert len(results) == 3
+    assert calls == [main.ML_FACE_BATCH_ENDPOINT]
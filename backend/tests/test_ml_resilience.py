@@ -0,0 +1,99 @@
+import ml_resilience
+from ml_resilience import CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(monkeypatch, failures=3, reset=30):
+    clock = FakeClock()
+    monkeypatch.setattr(ml_resilience.time, "monotonic", clock)
+    return CircuitBreaker(failure_threshold=failures, reset_timeout=reset), clock
+
+
+def test_opens_after_consecutive_failures(monkeypatch):
+    breaker, _ = make_breaker(monkeypatch)
+
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure("503")
+    assert breaker.state == "closed"
+
+    breaker.record_failure("503")
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.snapshot()["retry_in_seconds"] == 30
+
+
+def test_success_resets_the_failure_count(monkeypatch):
+    breaker, _ = make_breaker(monkeypatch)
+
+    breaker.record_failure("timeout")
+    breaker.record_failure("timeout")
+    breaker.record_success()
+    breaker.record_failure("timeout")
+
+    assert breaker.state == "closed"
+    assert breaker.failures == 1
+
+
+def test_half_open_lets_one_probe_through(monkeypatch):
+    breaker, clock = make_breaker(monkeypatch)
+    for _ in range(3):
+        breaker.record_failure("503")
+
+    clock.now += 29
+    assert not breaker.allow()
+
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # Everyone else keeps failing fast while the probe is out
+    assert not breaker.allow()
+
+
+def test_successful_probe_closes(monkeypatch):
+    breaker, clock = make_breaker(monkeypatch)
+    for _ in range(3):
+        breaker.record_failure("503")
+    clock.now += 30
+    assert breaker.allow()
+
+    breaker.record_success()
+
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_probe_reopens_for_another_timeout(monkeypatch):
+    breaker, clock = make_breaker(monkeypatch)
+    for _ in range(3):
+        breaker.record_failure("503")
+    clock.now += 30
+    assert breaker.allow()
+
+    breaker.record_failure("still down")
+
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    clock.now += 30
+    assert breaker.allow()
+
+
+def test_abandoned_probe_frees_the_slot(monkeypatch):
+    breaker, clock = make_breaker(monkeypatch)
+    for _ in range(3):
+        breaker.record_failure("503")
+    clock.now += 30
+    assert breaker.allow()
+
+    # The probe was cancelled before it got an answer
+    breaker.abandon()
+
+    assert breaker.state == "half_open"
+    assert breaker.allow()
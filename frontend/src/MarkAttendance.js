@@ -197,6 +197,13 @@ function MarkAttendance() {
         </div>
       );
     }
+    if (dressCode.pending) {
+      return (
+        <div className="alert alert-info" style={{ marginTop: '16px' }}>
+          Dress code check in progress - the result will appear on the attendance dashboard
+        </div>
+      );
+    }
 
     return (
       <div className="details-card" style={{ marginTop: '16px' }}>